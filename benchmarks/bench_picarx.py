@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+'''
+    Throughput and latency benchmarks for the Picarx control path.
+
+    Runs every benchmark against the simulated robot_hat backend, so it
+    measures the library's own overhead, and prints one JSON document:
+
+        python3 benchmarks/bench_picarx.py > before.json
+        python3 benchmarks/bench_picarx.py > after.json
+        python3 benchmarks/compare.py before.json after.json
+
+    --write-latency and --adc-latency charge a simulated bus cost to the
+    virtual clock; the bus traffic per call is reported either way.
+'''
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from picarx import Picarx, SimBackend, LatencyHistogram
+
+
+def measure(func, iterations, backend, warmup=0):
+    ''' call func(i) iterations times and summarize the per-call latency
+
+    The first `warmup` calls are not timed, so lazily built tables and
+    caches are in place before measuring.
+    '''
+    for i in range(warmup):
+        func(i)
+    histogram = LatencyHistogram()
+    clock = time.perf_counter_ns
+    writes, transactions, reads = backend.writes, backend.transactions, backend.reads
+    started = clock()
+    for i in range(iterations):
+        start = clock()
+        func(i)
+        histogram.record(clock() - start)
+    elapsed = (clock() - started) / 1e9
+    result = histogram.snapshot()
+    result['calls_per_sec'] = iterations / elapsed if elapsed else None
+    result['writes_per_call'] = (backend.writes - writes) / iterations
+    result['transactions_per_call'] = (backend.transactions - transactions) / iterations
+    result['reads_per_call'] = (backend.reads - reads) / iterations
+    return result
+
+
+def make_car(args):
+    backend = SimBackend(write_latency=args.write_latency, adc_latency=args.adc_latency)
+    px = Picarx(backend=backend)
+    px.set_line_reference([1000, 1000, 1000])
+    px.set_cliff_reference([200, 200, 200])
+    backend.set_grayscale([1500, 500, 1500])
+    backend.set_distance(50)
+    return px, backend
+
+
+def micro_benchmarks(args):
+    px, backend = make_car(args)
+    samples = [[random.randint(0, 4095) for _ in range(3)] for _ in range(1024)]
+    cases = {
+        'forward': lambda i: px.forward(i % 100),
+        'backward': lambda i: px.backward(i % 100),
+        'drive': lambda i: px.drive(i % 100, i % 61 - 30),
+        'set_dir_servo_angle': lambda i: px.set_dir_servo_angle(i % 61 - 30),
+        'set_cam_pan_angle': lambda i: px.set_cam_pan_angle(i % 181 - 90),
+        'set_cam_tilt_angle': lambda i: px.set_cam_tilt_angle(i % 101 - 35),
+        'set_cam_pan_angle_unchanged': lambda i: px.set_cam_pan_angle(10),
+        'get_grayscale_data': lambda i: px.get_grayscale_data(),
+        'get_line_status': lambda i: px.get_line_status(samples[i % 1024]),
+        'get_cliff_status': lambda i: px.get_cliff_status(samples[i % 1024]),
+        'get_distance': lambda i: px.get_distance(),
+    }
+    results = {}
+    for name, func in cases.items():
+        if args.only and name not in args.only:
+            continue
+        results[name] = measure(func, args.iterations, backend, args.warmup)
+    return results
+
+
+def line_follow_loop(px, backend):
+    # examples/5.minecart_plus.py without the prints and outHandle
+    track = [[1500, 500, 1500], [500, 1500, 1500], [1500, 1500, 500], [500, 500, 500]]
+    def step(i):
+        backend.set_grayscale(track[(i // 7) % 4])
+        state = px.get_line_status(px.get_grayscale_data())
+        if state[1] == 1:
+            px.set_dir_servo_angle(0)
+            px.forward(10)
+        elif state[0] == 1:
+            px.set_dir_servo_angle(-20)
+            px.forward(10)
+        elif state[2] == 1:
+            px.set_dir_servo_angle(20)
+            px.forward(10)
+        else:
+            px.stop()
+    return step
+
+
+def cliff_detect_loop(px, backend):
+    # examples/6.cliff_detection.py without text to speech
+    def step(i):
+        backend.set_grayscale([100, 100, 100] if i % 50 == 0 else [800, 800, 800])
+        if px.get_cliff_status(px.get_grayscale_data()):
+            px.backward(80)
+        else:
+            px.stop()
+    return step
+
+
+def obstacle_avoid_loop(px, backend):
+    # examples/4.avoiding_obstacles.py without its sleeps
+    def step(i):
+        backend.set_distance((i * 3) % 80 + 5)
+        distance = round(px.get_distance(), 2)
+        if distance >= 40:
+            px.set_dir_servo_angle(0)
+            px.forward(50)
+        elif distance >= 20:
+            px.set_dir_servo_angle(30)
+            px.forward(50)
+        else:
+            px.set_dir_servo_angle(-30)
+            px.backward(50)
+    return step
+
+
+def loop_benchmarks(args):
+    results = {}
+    for name, build in [('line_follow', line_follow_loop),
+                        ('cliff_detect', cliff_detect_loop),
+                        ('obstacle_avoid', obstacle_avoid_loop)]:
+        if args.only and name not in args.only:
+            continue
+        px, backend = make_car(args)
+        results[name] = measure(build(px, backend), args.iterations, backend, args.warmup)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--iterations', type=int, default=20000)
+    parser.add_argument('--warmup', type=int, default=1000, help='untimed calls before each benchmark')
+    parser.add_argument('--write-latency', type=float, default=0.0, help='simulated seconds per bus write')
+    parser.add_argument('--adc-latency', type=float, default=0.0, help='simulated seconds per ADC read')
+    parser.add_argument('--only', nargs='*', help='benchmark names to run')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'iterations': args.iterations,
+        'warmup': args.warmup,
+        'write_latency': args.write_latency,
+        'adc_latency': args.adc_latency,
+        'calls': micro_benchmarks(args),
+        'loops': loop_benchmarks(args),
+    }
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+'''
+    Compare two bench_picarx.py reports:
+
+        python3 benchmarks/compare.py before.json after.json
+'''
+import json
+import sys
+
+
+def main():
+    if len(sys.argv) != 3:
+        print(__doc__)
+        sys.exit(1)
+    with open(sys.argv[1]) as f:
+        before = json.load(f)
+    with open(sys.argv[2]) as f:
+        after = json.load(f)
+
+    print('%-30s %12s %12s %8s %10s %10s' % ('benchmark', 'before/s', 'after/s', 'change', 'p99 before', 'p99 after'))
+    for section in ('calls', 'loops'):
+        for name, old in before.get(section, {}).items():
+            new = after.get(section, {}).get(name)
+            if new is None or not old.get('calls_per_sec'):
+                continue
+            change = (new['calls_per_sec'] / old['calls_per_sec'] - 1) * 100
+            print('%-30s %12.0f %12.0f %+7.1f%% %8.1fus %8.1fus' % (
+                name, old['calls_per_sec'], new['calls_per_sec'], change,
+                old['p99_us'], new['p99_us']))
+
+
+if __name__ == '__main__':
+    main()
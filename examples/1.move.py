@@ -1,6 +1,16 @@
 from picarx import Picarx
 import time
 
+# sweep speed of the servos, in degrees per second and degrees per second^2
+SWEEP_VELOCITY = 100
+SWEEP_ACCELERATION = 400
+
+
+def sweep(px, axis):
+    # each move returns at once, result() waits for it to finish
+    for angle in (35, -35, 0):
+        px.move(axis, angle, SWEEP_VELOCITY, SWEEP_ACCELERATION, 's_curve').result()
+
 
 if __name__ == "__main__":
     try:
@@ -8,41 +18,16 @@ if __name__ == "__main__":
         px = Picarx()
 
         # test motor
-        px.forward(30)
+        px.move('speed', 30, 100, 200).result()
         time.sleep(0.5)
         # test direction servo
-        for angle in range(0, 35):
-            px.set_dir_servo_angle(angle)
-            time.sleep(0.01)
-        for angle in range(35, -35, -1):
-            px.set_dir_servo_angle(angle)
-            time.sleep(0.01)
-        for angle in range(-35, 0):
-            px.set_dir_servo_angle(angle)
-            time.sleep(0.01)
+        sweep(px, 'dir')
+        px.move('speed', 0, 100, 200).result()
         px.stop()
         time.sleep(1)
         # test cam servos
-        for angle in range(0, 35):
-            px.set_cam_pan_angle(angle)
-            time.sleep(0.01)
-        for angle in range(35, -35, -1):
-            px.set_cam_pan_angle(angle)
-            time.sleep(0.01)        
-        for angle in range(-35, 0):
-            px.set_cam_pan_angle(angle)
-            time.sleep(0.01)
-        for angle in range(0, 35):
-            px.set_cam_tilt_angle(angle)
-            time.sleep(0.01)
-        for angle in range(35, -35,-1):
-            px.set_cam_tilt_angle(angle)
-            time.sleep(0.01)        
-        for angle in range(-35, 0):
-            px.set_cam_tilt_angle(angle)
-            time.sleep(0.01)
+        sweep(px, 'cam_pan')
+        sweep(px, 'cam_tilt')
     finally:
         px.stop()
         time.sleep(0.2)
-
-
@@ -31,17 +31,13 @@ if __name__ == "__main__":
             key = key.lower()
             if key in('wsadikjl'): 
                 if 'w' == key:
-                    px.set_dir_servo_angle(0)
-                    px.forward(80)
+                    px.drive(80, 0)
                 elif 's' == key:
-                    px.set_dir_servo_angle(0)
-                    px.backward(80)
+                    px.drive(-80, 0)
                 elif 'a' == key:
-                    px.set_dir_servo_angle(-30)
-                    px.forward(80)
+                    px.drive(80, -30)
                 elif 'd' == key:
-                    px.set_dir_servo_angle(30)
-                    px.forward(80)
+                    px.drive(80, 30)
                 elif 'i' == key:
                     tilt_angle+=5
                     if tilt_angle>30:
@@ -1,5 +1,4 @@
-from picarx import Picarx
-import time
+from picarx import Picarx, ObstacleAvoider
 
 POWER = 50
 SafeDistance = 40   # > 40 safe
@@ -10,26 +9,21 @@ def main():
     try:
         px = Picarx()
         # px = Picarx(ultrasonic_pins=['D2','D3']) # tring, echo
-       
-        while True:
-            distance = round(px.ultrasonic.read(), 2)
-            print("distance: ",distance)
-            if distance >= SafeDistance:
-                px.set_dir_servo_angle(0)
-                px.forward(POWER)
-            elif distance >= DangerDistance:
-                px.set_dir_servo_angle(30)
-                px.forward(POWER)
-                time.sleep(0.1)
-            else:
-                px.set_dir_servo_angle(-30)
-                px.backward(POWER)
-                time.sleep(0.5)
+        # ping in the background so reading the distance never blocks,
+        # drop spurious echoes and ping less often while nothing is near
+        px.start_ranging(filter=True, adaptive=True)
+
+        # turns and reverses are timed states, the distance is still
+        # checked 50 times per second while they run
+        avoider = ObstacleAvoider(px, power=POWER,
+                                  safe_distance=SafeDistance,
+                                  danger_distance=DangerDistance)
+        avoider.run()
 
     finally:
+        px.stop_ranging()
         px.forward(0)
 
 
 if __name__ == "__main__":
     main()
-
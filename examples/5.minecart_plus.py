@@ -12,7 +12,7 @@
         and the background gray value.
 
 '''
-from picarx import Picarx
+from picarx import Picarx, LineTracker
 from time import sleep
 
 px = Picarx()
@@ -22,60 +22,16 @@ px = Picarx()
 # or manual modify reference value by follow code
 # px.set_line_reference([1400, 1400, 1400])
 
-current_state = None
 px_power = 10
-offset = 20
-last_state = "stop"
 
-def outHandle():
-    global last_state, current_state
-    if last_state == 'left':
-        px.set_dir_servo_angle(-30)
-        px.backward(10)
-    elif last_state == 'right':
-        px.set_dir_servo_angle(30)
-        px.backward(10)
-    while True:
-        gm_val_list = px.get_grayscale_data()
-        gm_state = get_status(gm_val_list)
-        print("outHandle gm_val_list: %s, %s"%(gm_val_list, gm_state))
-        currentSta = gm_state
-        if currentSta != last_state:
-            break
-    sleep(0.001)
-
-def get_status(val_list):
-    _state = px.get_line_status(val_list)  # [bool, bool, bool], 0 means line, 1 means background
-    if _state == [0, 0, 0]:
-        return 'stop'
-    elif _state[1] == 1:
-        return 'forward'
-    elif _state[0] == 1:
-        return 'right'
-    elif _state[2] == 1:
-        return 'left'
+# PID steering on the line position, 100 times per second; backs up to
+# find the line again when it is lost and gives up after 2 seconds
+tracker = LineTracker(px, speed=px_power, frequency=100, lost_timeout=2.0)
 
 if __name__=='__main__':
     try:
-        while True:
-            gm_val_list = px.get_grayscale_data()
-            gm_state = get_status(gm_val_list)
-            print("gm_val_list: %s, %s"%(gm_val_list, gm_state))
-
-            if gm_state != "stop":
-                last_state = gm_state
-
-            if gm_state == 'forward':
-                px.set_dir_servo_angle(0)
-                px.forward(px_power) 
-            elif gm_state == 'left':
-                px.set_dir_servo_angle(offset)
-                px.forward(px_power) 
-            elif gm_state == 'right':
-                px.set_dir_servo_angle(-offset)
-                px.forward(px_power) 
-            else:
-                outHandle()
+        stats = tracker.run()
+        print("line lost %d times, loop stats: %s" % (tracker.line_losses, stats.as_dict()))
     finally:
         px.stop()
         print("stop and exit")
@@ -24,35 +24,37 @@ px = Picarx()
 # manual modify reference value
 px.set_cliff_reference([200, 200, 200])
 
-current_state = None
 px_power = 10
 offset = 20
-last_state = "safe"
 
 
+def on_cliff(values):
+    # runs on the watchdog's notifier thread, so speaking doesn't delay
+    # the next cliff check
+    tts.say("danger")
+
+
+def step():
+    gm_val_list = px.get_grayscale_data()
+    gm_state = px.get_cliff_status(gm_val_list)
+    # print("cliff status is:  %s"%gm_state)
+
+    if gm_state is False:
+        px.stop()
+    else:
+        # the watchdog has already stopped the car, back away
+        px.backward(80)
+
 
 if __name__=='__main__':
     try:
-        while True:
-            gm_val_list = px.get_grayscale_data()
-            gm_state = px.get_cliff_status(gm_val_list)
-            # print("cliff status is:  %s"%gm_state)
-
-            if gm_state is False:
-                state = "safe"
-                px.stop()
-            else:
-                state = "danger"   
-                px.backward(80)
-                if last_state == "safe":
-                    tts.say("danger")
-                    sleep(0.1)
-            last_state = state
+        # stop the motors within one 5 ms sample of seeing a cliff,
+        # independently of this loop
+        watchdog = px.start_cliff_watchdog(rate=200, on_cliff=on_cliff)
+        px.control_loop(step, 50).run()
 
     finally:
+        px.stop_cliff_watchdog()
         px.stop()
         print("stop and exit")
         sleep(0.1)
-
-
-                
\ No newline at end of file
@@ -0,0 +1,30 @@
+'''
+    Network remote control for Picar-X:
+
+    Listens for UDP commands on port 8765 and applies the newest one 50
+    times per second. The car stops if no command arrives for 0.5 s, so
+    the client should keep sending while a key is held, e.g.:
+
+        from picarx import TeleopClient
+        client = TeleopClient('picarx.local')
+        client.send(speed=40, steer=-10, pan=0, tilt=10)
+'''
+from picarx import Picarx, TeleopServer
+from time import sleep
+
+if __name__ == "__main__":
+    px = Picarx()
+    server = TeleopServer(px, port=8765, rate=50, deadman_timeout=0.5)
+    try:
+        server.start()
+        print("listening on %s:%d" % server.address)
+        while True:
+            sleep(5)
+            print(server.stats())
+    finally:
+        server.stop()
+        px.set_cam_tilt_angle(0)
+        px.set_cam_pan_angle(0)
+        px.set_dir_servo_angle(0)
+        px.stop()
+        sleep(.2)
@@ -141,10 +141,12 @@ def cali_helper():
                 key = readchar.readkey()
                 key = key.lower()
                 if key == 'y':
-                    px.dir_servo_calibrate(servos_offset[0])
-                    px.cam_pan_servo_calibrate(servos_offset[1])
-                    px.cam_tilt_servo_calibrate(servos_offset[2])
-                    px.motor_direction_calibrate(motor_num +1 , motors_offset[motor_num])
+                    # write the config file once for all four values
+                    with px.calibration.transaction():
+                        px.dir_servo_calibrate(servos_offset[0])
+                        px.cam_pan_servo_calibrate(servos_offset[1])
+                        px.cam_tilt_servo_calibrate(servos_offset[2])
+                        px.motor_direction_calibrate(motor_num +1 , motors_offset[motor_num])
                     sleep(0.2)
                     servos_offset = [px.dir_cali_val, px.cam_pan_cali_val, px.cam_tilt_cali_val]
                     show_info()
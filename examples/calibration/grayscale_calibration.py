@@ -249,8 +249,9 @@ def main():
             while True:
                 key = key.lower()
                 if key == 'y':
-                    px.set_line_reference(line_reference)
-                    px.set_cliff_reference(cliff_reference)
+                    with px.calibration.transaction():
+                        px.set_line_reference(line_reference)
+                        px.set_cliff_reference(cliff_reference)
                     current_mode = 'saved'
                     print("\033[1A\033[J", end='\r')
                     break
@@ -1,3 +1,21 @@
-from .picarx import Picarx
+from .picarx import Picarx, SensorSnapshot
+from .async_picarx import AsyncPicarx
+from .backend import Backend, RobotHatBackend
+from .clock import MonotonicClock, VirtualClock
+from .sim import SimBackend
+from .ranging import DistanceReading, UltrasonicRanger
+from .sampler import GrayscaleSampler
+from .loop import ControlLoop, LoopStats
+from .motion import MotionEngine, MotionProfile
+from .calibration import Calibration, CalibrationStore
+from .telemetry import Recorder, read_telemetry
+from .replay import Replay, diff_commands
+from .stats import LatencyHistogram
+from .avoidance import ObstacleAvoider
+from .watchdog import CliffWatchdog
+from .teleop import TeleopClient, TeleopServer
+from .daemon import PicarxClient, PicarxDaemon, SharedState
+from .line_tracking import LineTracker, PID, line_offset
+from .filters import AdaptivePingScheduler, DistanceFilter, FilteredDistance, RunningMedian
 
-name = "decawave_1001_uart"
\ No newline at end of file
+name = "decawave_1001_uart"
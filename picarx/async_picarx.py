@@ -0,0 +1,114 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from .picarx import Picarx
+
+
+class AsyncPicarx(object):
+    ''' asyncio front end for Picarx
+
+    Every call that touches the hardware runs on a dedicated single
+    thread executor, so the event loop never blocks on the bus and the
+    calls reach the car in the order they were awaited.
+
+    px = await AsyncPicarx.create()
+    await px.drive(30, 0)
+    distance = await px.get_distance()
+    '''
+
+    def __init__(self, picarx=None, executor=None, **kwargs):
+        self.px = picarx if picarx is not None else Picarx(**kwargs)
+        self._own_executor = executor is None
+        self.executor = executor if executor is not None else \
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix='picarx-io')
+
+    @classmethod
+    async def create(cls, executor=None, **kwargs):
+        '''
+        Build the Picarx off the event loop, its __init__ resets the MCU and sleeps.
+        A given executor stays the caller's, close() does not shut it down.
+        '''
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='picarx-io')
+        px = await asyncio.get_running_loop().run_in_executor(executor, lambda: Picarx(**kwargs))
+        self = cls(px, executor)
+        self._own_executor = own_executor
+        return self
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def close(self):
+        await self._run(self.px.stop)
+        if self._own_executor:
+            self.executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    # --------- actuators ---------
+    async def set_motor_speed(self, motor, speed):
+        await self._run(self.px.set_motor_speed, motor, speed)
+
+    async def set_power(self, speed):
+        await self._run(self.px.set_power, speed)
+
+    async def set_dir_servo_angle(self, value):
+        await self._run(self.px.set_dir_servo_angle, value)
+
+    async def set_cam_pan_angle(self, value):
+        await self._run(self.px.set_cam_pan_angle, value)
+
+    async def set_cam_tilt_angle(self, value):
+        await self._run(self.px.set_cam_tilt_angle, value)
+
+    async def forward(self, speed):
+        await self._run(self.px.forward, speed)
+
+    async def backward(self, speed):
+        await self._run(self.px.backward, speed)
+
+    async def drive(self, speed, steer):
+        await self._run(self.px.drive, speed, steer)
+
+    async def stop(self):
+        await self._run(self.px.stop)
+
+    async def reset(self):
+        await self._run(self.px.reset)
+
+    # --------- sensors ---------
+    async def get_grayscale_data(self):
+        return await self._run(self.px.get_grayscale_data)
+
+    async def get_distance(self, times=10):
+        ''' distance in cm, -1 for no echo
+
+        The sensor is pinged one attempt at a time, so cancelling the
+        awaiting task takes effect within a single echo timeout instead of
+        holding the executor for all `times` attempts. Each attempt goes
+        through Picarx.get_distance(), so it is recorded like any other
+        reading. With background ranging running the latest published
+        range is returned at once, filtered if the ranging is.
+        '''
+        px = self.px
+        if px.ranger is not None:
+            return await self._run(px.get_distance)
+        for _ in range(times):
+            distance = await self._run(px.get_distance, 1)
+            if distance != -1:
+                return distance
+        return -1
+
+    async def get_distance_filtered(self):
+        return await self._run(self.px.get_distance_filtered)
+
+    def get_line_status(self, gm_val_list):
+        return self.px.get_line_status(gm_val_list)
+
+    def get_cliff_status(self, gm_val_list):
+        return self.px.get_cliff_status(gm_val_list)
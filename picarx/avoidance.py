@@ -0,0 +1,92 @@
+class ObstacleAvoider(object):
+    ''' tick driven obstacle avoidance for Picarx
+
+    The behaviour of examples/4.avoiding_obstacles.py as a state machine:
+    cruise straight while the way is clear (distance >= safe_distance),
+    turn while an obstacle is nearer than that, and reverse with the
+    wheels the other way while it is nearer than danger_distance.
+
+    Turning and reversing last at least turn_time and reverse_time, but
+    they are timed states instead of sleeps: distance is read on every
+    tick, so an obstacle inside danger_distance interrupts a turn at
+    once and restarts a reverse. With background ranging running
+    (Picarx.start_ranging) a tick never waits for an echo.
+
+    avoider = ObstacleAvoider(px, power=50)
+    avoider.run()
+    '''
+
+    CRUISE = 'cruise'
+    TURN = 'turn'
+    REVERSE = 'reverse'
+
+    def __init__(self, px, power=50, safe_distance=40, danger_distance=20,
+                 turn_angle=30, turn_time=0.1, reverse_time=0.5,
+                 no_echo_is_clear=True, frequency=50):
+        self.px = px
+        self.power = power
+        self.safe_distance = safe_distance
+        self.danger_distance = danger_distance
+        self.turn_angle = turn_angle
+        self.turn_time = turn_time
+        self.reverse_time = reverse_time
+        self.no_echo_is_clear = no_echo_is_clear
+        self.clock = px.backend.clock
+        self.loop = px.control_loop(self.tick, frequency)
+        self.state = self.CRUISE
+        self.distance = None
+        self.min_distance = None
+        self._until = 0.0
+
+    def _enter(self, state, duration, now):
+        self.state = state
+        self._until = now + duration
+
+    def tick(self):
+        now = self.clock.time()
+        distance = self.px.get_distance()
+        self.distance = distance
+        if distance < 0:
+            # -1/-2: no echo within range
+            distance = float('inf') if self.no_echo_is_clear else 0
+        elif self.min_distance is None or distance < self.min_distance:
+            self.min_distance = distance
+
+        busy = now < self._until
+        if distance < self.danger_distance:
+            self._enter(self.REVERSE, self.reverse_time, now)
+        elif distance < self.safe_distance:
+            if not busy:
+                self._enter(self.TURN, self.turn_time, now)
+        elif not busy:
+            self.state = self.CRUISE
+
+        px = self.px
+        if self.state == self.CRUISE:
+            px.drive(self.power, 0)
+        elif self.state == self.TURN:
+            px.drive(self.power, self.turn_angle)
+        else:
+            px.drive(-self.power, -self.turn_angle)
+        return self.state
+
+    def run(self, iterations=None, duration=None):
+        '''
+        Avoid obstacles in the calling thread, stopping the car at the end.
+        '''
+        self.loop.step = self.tick
+        try:
+            return self.loop.run(iterations, duration)
+        finally:
+            self.px.stop()
+
+    def start(self):
+        '''
+        Avoid obstacles in a background thread.
+        '''
+        self.loop.step = self.tick
+        self.loop.start()
+
+    def stop(self):
+        self.loop.stop()
+        self.px.stop()
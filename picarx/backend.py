@@ -0,0 +1,226 @@
+from .clock import MonotonicClock
+import ast
+import json
+import os
+import tempfile
+import threading
+
+
+def parse_config(text):
+    '''
+    Parse a config file written either as JSON or in fileDB's
+    "name = value" line format into a dict of Python values.
+    '''
+    try:
+        data = json.loads(text)
+        if isinstance(data, dict):
+            return data
+    except ValueError:
+        pass
+    data = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#') or '=' not in line:
+            continue
+        name, value = [part.strip() for part in line.split('=', 1)]
+        try:
+            data[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            data[name] = value
+    return data
+
+
+def format_config(data):
+    '''
+    Format a dict in fileDB's "name = value" line format, which
+    parse_config() and robot_hat's fileDB both read back. Strings are
+    written bare, as fileDB stores them, everything else as JSON.
+    '''
+    lines = ['# robot-hat config and calibration value of PiCar-X']
+    for name, value in data.items():
+        if not isinstance(value, str):
+            value = json.dumps(value)
+        lines.append('%s = %s' % (name, value))
+    return '\n'.join(lines) + '\n'
+
+
+class Backend(object):
+    '''
+    Hardware backend that Picarx builds its devices from.
+
+    A backend is a factory for the robot_hat style devices Picarx uses
+    (pins, PWM channels, ADCs, servos, grayscale module, ultrasonic
+    sensor) plus the clock and config file storage.
+    '''
+
+    def __init__(self, clock=None):
+        self.clock = clock if clock is not None else MonotonicClock()
+
+    def time(self):
+        return self.clock.time()
+
+    def sleep(self, seconds):
+        self.clock.sleep(seconds)
+
+    # robot_hat Servo timing: -90..90 degrees is 500..2500 us of a 20 ms
+    # period, on a PWM channel counting to 4095
+    SERVO_MIN_PW = 500
+    SERVO_MAX_PW = 2500
+    SERVO_FRAME = 20000
+    SERVO_PERIOD = 4095
+
+    def servo_pulse(self, angle):
+        '''
+        Pulse width register value that Servo.angle(angle) would write.
+        '''
+        angle = max(-90, min(90, angle))
+        pulse_width_time = (angle + 90) / 180.0 * (self.SERVO_MAX_PW - self.SERVO_MIN_PW) + self.SERVO_MIN_PW
+        return int(pulse_width_time / self.SERVO_FRAME * self.SERVO_PERIOD)
+
+    def flush(self, writes):
+        '''
+        Apply a batch of precomputed writes, given as (device, method, args).
+
+        The batch is issued back to back with no computation in between.
+        Backends that can coalesce bus transactions override this.
+        '''
+        for device, method, args in writes:
+            getattr(device, method)(*args)
+
+    def reset_mcu(self):
+        raise NotImplementedError
+
+    def pin(self, name):
+        raise NotImplementedError
+
+    def input_pin(self, name):
+        raise NotImplementedError
+
+    def pwm(self, channel):
+        raise NotImplementedError
+
+    def adc(self, channel):
+        raise NotImplementedError
+
+    def servo(self, channel):
+        raise NotImplementedError
+
+    def grayscale_module(self, adc0, adc1, adc2, reference=None):
+        raise NotImplementedError
+
+    def ultrasonic(self, trig, echo, timeout=0.02):
+        raise NotImplementedError
+
+    def read_config(self, path):
+        '''
+        Read every value of the config file at path in one pass, {} if the
+        file does not exist yet.
+        '''
+        try:
+            with open(path, 'r') as f:
+                return parse_config(f.read())
+        except FileNotFoundError:
+            return {}
+
+    def write_config(self, path, data):
+        '''
+        Replace the config file at path with data in fileDB format,
+        atomically: the new content goes to a temporary file that is
+        renamed over the old one, so a crash never leaves a half written
+        file.
+        '''
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix='.config-', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(format_config(data))
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                # keep the owner and mode of the file being replaced
+                st = os.stat(path)
+                os.chmod(tmp, st.st_mode & 0o7777)
+                os.chown(tmp, st.st_uid, st.st_gid)
+            except (FileNotFoundError, PermissionError):
+                pass
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
+class _BusDevice(object):
+    '''
+    robot_hat device whose method calls hold the bus lock.
+    '''
+
+    def __init__(self, device, lock):
+        self._device = device
+        self._lock = lock
+
+    def __getattr__(self, name):
+        attr = getattr(self._device, name)
+        if not callable(attr):
+            return attr
+        lock = self._lock
+
+        def locked(*args, **kwargs):
+            with lock:
+                return attr(*args, **kwargs)
+        return locked
+
+
+class RobotHatBackend(Backend):
+    '''
+    Backend driving the real SunFounder Robot HAT through robot_hat.
+
+    The PWM channels, servos and ADC are registers of one MCU at one I2C
+    address, and an ADC read is two transactions (select the channel,
+    then read it). Every call on those devices, and every flush() batch,
+    therefore holds `bus_lock`, so no write can land between the two
+    halves of a read. The Picarx device locks still guard Picarx state;
+    this lock is only held for the bus operation itself. Pins and the
+    ultrasonic sensor are GPIO and don't take it.
+    '''
+
+    def __init__(self, clock=None):
+        import robot_hat
+        super().__init__(clock)
+        self._rh = robot_hat
+        self.bus_lock = threading.RLock()
+
+    def _bus(self, device):
+        return _BusDevice(device, self.bus_lock)
+
+    def flush(self, writes):
+        with self.bus_lock:
+            Backend.flush(self, writes)
+
+    def reset_mcu(self):
+        with self.bus_lock:
+            self._rh.utils.reset_mcu()
+
+    def pin(self, name):
+        return self._rh.Pin(name)
+
+    def input_pin(self, name):
+        Pin = self._rh.Pin
+        return Pin(name, mode=Pin.IN, pull=Pin.PULL_DOWN)
+
+    def pwm(self, channel):
+        return self._bus(self._rh.PWM(channel))
+
+    def adc(self, channel):
+        return self._bus(self._rh.ADC(channel))
+
+    def servo(self, channel):
+        return self._bus(self._rh.Servo(channel))
+
+    def grayscale_module(self, adc0, adc1, adc2, reference=None):
+        # robot_hat wants its own ADCs; the module read holds the lock instead
+        adcs = [adc._device if isinstance(adc, _BusDevice) else adc for adc in (adc0, adc1, adc2)]
+        return self._bus(self._rh.Grayscale_Module(*adcs, reference=reference))
+
+    def ultrasonic(self, trig, echo, timeout=0.02):
+        return self._rh.Ultrasonic(trig, echo, timeout=timeout)
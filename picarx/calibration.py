@@ -0,0 +1,177 @@
+import copy
+from contextlib import contextmanager
+
+
+class Calibration(object):
+    '''
+    Calibration values of one car, with the config file key of each field.
+    '''
+
+    KEYS = {
+        'dir_servo': 'picarx_dir_servo',
+        'cam_pan_servo': 'picarx_cam_pan_servo',
+        'cam_tilt_servo': 'picarx_cam_tilt_servo',
+        'dir_motor': 'picarx_dir_motor',
+        'line_reference': 'line_reference',
+        'cliff_reference': 'cliff_reference',
+    }
+    FIELDS = dict((key, field) for field, key in KEYS.items())
+
+    DEFAULT_LINE_REF = [1000, 1000, 1000]
+    DEFAULT_CLIFF_REF = [500, 500, 500]
+
+    __slots__ = tuple(KEYS)
+
+    def __init__(self, dir_servo=0.0, cam_pan_servo=0.0, cam_tilt_servo=0.0,
+                 dir_motor=None, line_reference=None, cliff_reference=None):
+        self.dir_servo = float(dir_servo)
+        self.cam_pan_servo = float(cam_pan_servo)
+        self.cam_tilt_servo = float(cam_tilt_servo)
+        self.dir_motor = [int(v) for v in (dir_motor or [1, 1])]
+        self.line_reference = list(line_reference or self.DEFAULT_LINE_REF)
+        self.cliff_reference = list(cliff_reference or self.DEFAULT_CLIFF_REF)
+
+    @classmethod
+    def from_dict(cls, data):
+        '''
+        Build from a dict keyed by config file key, ignoring unknown keys.
+        '''
+        return cls(**dict((cls.FIELDS[key], value) for key, value in data.items() if key in cls.FIELDS))
+
+    def to_dict(self):
+        return dict((key, copy.copy(getattr(self, field))) for field, key in self.KEYS.items())
+
+    def __eq__(self, other):
+        return isinstance(other, Calibration) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return 'Calibration(%s)' % ', '.join('%s=%r' % (f, getattr(self, f)) for f in self.KEYS)
+
+
+class CalibrationStore(object):
+    ''' in-memory calibration with named profiles and batched saving
+
+    The whole config file is parsed once on load. Changes are kept in
+    memory and written back in one atomic write-and-rename: right away
+    when made outside a transaction, or once when the outermost
+    transaction() block exits.
+
+    The file keeps the active profile's values as flat top level keys,
+    as older versions wrote them, plus every profile under "profiles".
+    Other keys in the file belong to other programs sharing it and are
+    written back unchanged.
+
+    A transaction() block that raises is rolled back: the store returns
+    to its state at the start of the block, nothing is written and
+    on_rollback(calibration) is called with the restored active
+    calibration. A Picarx sets it to re-apply the offsets and references.
+
+    with store.transaction():
+        store.set('picarx_dir_servo', 1.2)
+        store.set('line_reference', [1400, 1400, 1400])
+    '''
+
+    DEFAULT_PROFILE = 'default'
+
+    def __init__(self, backend, path, profile=None):
+        self.backend = backend
+        self.path = path
+        self._depth = 0
+        self._dirty = False
+        self.on_rollback = None
+        self.load(profile)
+
+    OWN_KEYS = tuple(Calibration.FIELDS) + ('profile', 'profiles')
+
+    def load(self, profile=None):
+        data = self.backend.read_config(self.path)
+        self._other = dict((key, value) for key, value in data.items() if key not in self.OWN_KEYS)
+        profiles = data.get('profiles')
+        if isinstance(profiles, dict) and profiles:
+            self._profiles = dict((name, Calibration.from_dict(values)) for name, values in profiles.items())
+        else:
+            # a file from before profiles existed
+            self._profiles = {self.DEFAULT_PROFILE: Calibration.from_dict(data)}
+        if profile is None:
+            profile = data.get('profile', self.DEFAULT_PROFILE)
+        self.select(profile)
+        self._dirty = False
+
+    @property
+    def calibration(self):
+        '''
+        Calibration of the active profile.
+        '''
+        return self._profiles[self.profile]
+
+    def profiles(self):
+        return sorted(self._profiles)
+
+    def select(self, profile):
+        '''
+        Make profile active, creating it from the defaults if it is new.
+        '''
+        if profile not in self._profiles:
+            self._profiles[profile] = Calibration()
+        self.profile = profile
+        return self.calibration
+
+    def get(self, name, default_value=None):
+        '''
+        Value of config file key name in the active profile (fileDB style).
+        '''
+        field = Calibration.FIELDS.get(name)
+        if field is None:
+            return default_value
+        return copy.copy(getattr(self.calibration, field))
+
+    def set(self, name, value):
+        '''
+        Set config file key name in the active profile (fileDB style).
+        '''
+        if name not in Calibration.FIELDS:
+            raise KeyError("unknown calibration key: %s" % name)
+        self.update(**{Calibration.FIELDS[name]: value})
+
+    def update(self, **fields):
+        '''
+        Set Calibration fields of the active profile by field name.
+        '''
+        calibration = self.calibration
+        values = dict((field, getattr(calibration, field)) for field in Calibration.KEYS)
+        for field, value in fields.items():
+            if field not in values:
+                raise KeyError("unknown calibration field: %s" % field)
+            values[field] = value
+        self._profiles[self.profile] = Calibration(**values)
+        self._dirty = True
+        if self._depth == 0:
+            self.flush()
+
+    @contextmanager
+    def transaction(self):
+        # Calibrations are replaced on update, never changed in place
+        snapshot = (dict(self._profiles), self.profile, self._dirty)
+        self._depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._profiles, self.profile, self._dirty = snapshot
+            if self.on_rollback is not None:
+                self.on_rollback(self.calibration)
+            raise
+        finally:
+            self._depth -= 1
+        if self._depth == 0 and self._dirty:
+            self.flush()
+
+    def to_dict(self):
+        data = dict(self._other)
+        data.update(self.calibration.to_dict())
+        data['profile'] = self.profile
+        data['profiles'] = dict((name, c.to_dict()) for name, c in self._profiles.items())
+        return data
+
+    def flush(self):
+        self.backend.write_config(self.path, self.to_dict())
+        self._dirty = False
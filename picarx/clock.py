@@ -0,0 +1,84 @@
+import time
+import threading
+
+
+class MonotonicClock(object):
+    '''
+    Wall clock used on the real car, backed by time.monotonic().
+    '''
+
+    def time(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def follow(self):
+        pass
+
+
+class VirtualClock(object):
+    '''
+    Simulated clock for running control code faster than real time.
+
+    sleep() advances the clock instantly instead of blocking, so a loop
+    that paces itself with the clock runs as fast as the CPU allows.
+
+    Background threads (sampling, ranging, the cliff watchdog, motion
+    and started control loops) call follow() first. In such a thread
+    sleep() does not advance the clock but waits for the foreground to
+    do so, with sleep(), advance() or set(), so background threads never
+    run simulated time away from the code under test. A follower's sleep
+    returns after at most FOLLOW_TIMEOUT real seconds even if the clock
+    has not moved, so it can notice that it is being stopped; see
+    sleep_until().
+    '''
+
+    FOLLOW_TIMEOUT = 0.01
+
+    def __init__(self, start=0.0):
+        self._now = float(start)
+        self._lock = threading.Condition()
+        self._local = threading.local()
+
+    def time(self):
+        return self._now
+
+    def follow(self):
+        self._local.follower = True
+
+    def sleep(self, seconds):
+        if getattr(self._local, 'follower', False):
+            if seconds > 0:
+                until = self._now + seconds
+                with self._lock:
+                    self._lock.wait_for(lambda: self._now >= until, self.FOLLOW_TIMEOUT)
+            return
+        if seconds > 0:
+            self.advance(seconds)
+        # give other threads a chance to run
+        time.sleep(0)
+
+    def advance(self, seconds):
+        with self._lock:
+            self._now += seconds
+            self._lock.notify_all()
+
+    def set(self, now):
+        with self._lock:
+            self._now = float(now)
+            self._lock.notify_all()
+
+
+def sleep_until(clock, deadline, running):
+    '''
+    Sleep until clock reaches deadline, giving up once running() is
+    false. For background loops, which may be woken early by a
+    VirtualClock they follow.
+    '''
+    now = clock.time()
+    while now < deadline and running():
+        clock.sleep(deadline - now)
+        now = clock.time()
+    return now
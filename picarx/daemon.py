@@ -0,0 +1,307 @@
+'''
+    Hardware owner daemon for Picarx.
+
+    One process owns the Picarx and publishes sensor and actuator state
+    into a shared-memory segment guarded by a seqlock; any number of
+    client processes read it without locks or system calls and send
+    commands over a Unix socket:
+
+        python3 -m picarx.daemon            # on the car
+
+        from picarx.daemon import PicarxClient
+        car = PicarxClient()
+        car.state()['grayscale']
+        car.drive(30, 0)
+'''
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+import warnings
+import zlib
+from multiprocessing import shared_memory
+
+SHM_NAME = 'picarx'
+SOCKET_PATH = '/tmp/picarx.sock'
+
+# seqlock counter, then the published state and its CRC-32
+SEQ = struct.Struct('<Q')
+STATE = struct.Struct('<d3i6d')
+CRC = struct.Struct('<I')
+STATE_FIELDS = ('grayscale_time', 'grayscale', 'distance_time', 'distance',
+                'dir_angle', 'cam_pan_angle', 'cam_tilt_angle', 'speed')
+SHM_SIZE = SEQ.size + STATE.size + CRC.size
+
+# Picarx methods clients may call
+COMMANDS = ('forward', 'backward', 'drive', 'stop', 'set_power', 'set_motor_speed',
+            'set_dir_servo_angle', 'set_cam_pan_angle', 'set_cam_tilt_angle', 'reset')
+
+
+class SharedState(object):
+    ''' seqlock protected state record in shared memory
+
+    The writer makes the counter odd, writes the record and makes it even
+    again. A reader copies the record and retries if the counter was odd
+    or changed meanwhile, so readers never block the writer or each
+    other. There must be only one writer.
+
+    Python has no memory barriers, so on weakly ordered CPUs such as the
+    Pi's ARM cores a reader could see the counter and the record updated
+    out of order. The record therefore carries a CRC-32, and a copy that
+    does not match it is retried as well: the counter only avoids most
+    wasted copies, the checksum is what rejects torn ones.
+
+    read() gives up after `timeout` seconds, e.g. when the daemon died in
+    the middle of a write, and raises RuntimeError.
+    '''
+
+    CRC_OFFSET = SEQ.size + STATE.size
+
+    def __init__(self, name=SHM_NAME, create=False):
+        if create:
+            try:
+                # left over from a daemon that did not shut down cleanly;
+                # PicarxDaemon checks there is no live one first
+                shared_memory.SharedMemory(name).unlink()
+            except FileNotFoundError:
+                pass
+            self.shm = shared_memory.SharedMemory(name, create=True, size=SHM_SIZE)
+        else:
+            self.shm = _attach(name)
+        self.owner = create
+        self._seq = 0
+        if create:
+            self.write(0.0, 0, 0, 0, 0.0, -1.0, 0.0, 0.0, 0.0, 0.0)
+
+    def write(self, *values):
+        buf = self.shm.buf
+        record = STATE.pack(*values)
+        self._seq += 1
+        SEQ.pack_into(buf, 0, self._seq)
+        buf[SEQ.size:self.CRC_OFFSET] = record
+        CRC.pack_into(buf, self.CRC_OFFSET, zlib.crc32(record))
+        self._seq += 1
+        SEQ.pack_into(buf, 0, self._seq)
+
+    def read(self, timeout=0.1):
+        buf = self.shm.buf
+        deadline = None
+        while True:
+            before = SEQ.unpack_from(buf, 0)[0]
+            if not before & 1:
+                record = bytes(buf[SEQ.size:self.CRC_OFFSET])
+                crc = CRC.unpack_from(buf, self.CRC_OFFSET)[0]
+                if SEQ.unpack_from(buf, 0)[0] == before and zlib.crc32(record) == crc:
+                    break
+            # a write is in progress: let the writer run, but not forever
+            if deadline is None:
+                deadline = time.monotonic() + timeout
+            elif time.monotonic() > deadline:
+                raise RuntimeError("no consistent state within %.3f s, is the daemon running?" % timeout)
+            time.sleep(0)
+        values = STATE.unpack(record)
+        state = {'grayscale_time': values[0], 'grayscale': list(values[1:4])}
+        state.update(zip(STATE_FIELDS[2:], values[4:]))
+        state['seq'] = before
+        return state
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # before Python 3.13 the resource tracker would unlink the
+        # daemon's segment when this client exits
+        shm = shared_memory.SharedMemory(name)
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def daemon_running(socket_path=SOCKET_PATH):
+    '''
+    True if a daemon accepts connections on socket_path.
+    '''
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+class PicarxDaemon(object):
+    ''' owns a Picarx and serves it to other processes
+
+    Samples the grayscale module and the background ultrasonic ranger at
+    `rate` Hz into SharedState, and runs line based JSON commands from the
+    Unix socket, one at a time:
+        {"cmd": "drive", "args": [30, 0]}  ->  {"ok": true, "result": null}
+
+    Raises RuntimeError if another daemon is serving socket_path; only
+    the socket and shared memory left behind by a dead one are removed.
+    A failed sample is kept in `error`, counted in `errors` and reported
+    with a RuntimeWarning; the rest of the state is still published, so
+    clients see the sample's age grow.
+    '''
+
+    def __init__(self, px, shm_name=SHM_NAME, socket_path=SOCKET_PATH, rate=50):
+        if daemon_running(socket_path):
+            raise RuntimeError("a Picarx daemon is already serving %s" % socket_path)
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.px = px
+        self.socket_path = socket_path
+        self.state = SharedState(shm_name, create=True)
+        self.errors = 0
+        self.error = None
+        self._lock = threading.Lock()
+        self._speed = 0.0
+        self._loop = px.control_loop(self._publish, rate)
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    reply = daemon.execute(line)
+                    self.wfile.write(json.dumps(reply).encode() + b'\n')
+
+        self._server = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+        self._server.daemon_threads = True
+        self._server_thread = None
+
+    def execute(self, line):
+        try:
+            request = json.loads(line)
+            cmd = request['cmd']
+            args = request.get('args', [])
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return {'ok': False, 'error': 'malformed request'}
+        if cmd not in COMMANDS:
+            return {'ok': False, 'error': 'unknown command: %s' % cmd}
+        try:
+            with self._lock:
+                result = getattr(self.px, cmd)(*args)
+                if cmd in ('forward', 'drive', 'set_power'):
+                    self._speed = float(args[0])
+                elif cmd == 'backward':
+                    self._speed = -float(args[0])
+                elif cmd in ('stop', 'reset'):
+                    self._speed = 0.0
+        except Exception as e:
+            return {'ok': False, 'error': str(e)}
+        return {'ok': True, 'result': result}
+
+    def _publish(self):
+        try:
+            # the ADC has its own lock, so sampling never waits for a command
+            self.px.grayscale.read()
+        except Exception as e:
+            # keep publishing, the old grayscale_time shows the sample failed
+            self._report(e)
+        try:
+            snapshot = self.px.snapshot()
+            if snapshot.grayscale is None:
+                grayscale_time, grayscale = 0.0, (0, 0, 0)
+            else:
+                grayscale_time, grayscale = snapshot.grayscale_time, snapshot.grayscale
+            if snapshot.distance is None:
+                distance_time, distance = 0.0, -1.0
+            else:
+                distance_time, distance = snapshot.distance_time, snapshot.distance
+            self.state.write(grayscale_time, *grayscale,
+                             distance_time, distance, snapshot.dir_angle,
+                             snapshot.cam_pan_angle, snapshot.cam_tilt_angle, self._speed)
+        except Exception as e:
+            self._report(e)
+
+    def _report(self, error):
+        self.errors += 1
+        self.error = error
+        warnings.warn("daemon sample failed: %r" % error, RuntimeWarning)
+
+    def start(self):
+        self.px.start_ranging()
+        self._loop.start()
+        self._server_thread = threading.Thread(target=self._server.serve_forever, name='picarx-daemon')
+        self._server_thread.daemon = True
+        self._server_thread.start()
+
+    def serve_forever(self):
+        self.start()
+        self._server_thread.join()
+
+    def shutdown(self):
+        if self._server_thread is not None:
+            self._server.shutdown()
+        self._server.server_close()
+        self._loop.stop()
+        self.px.stop_ranging()
+        self.px.stop()
+        self.state.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class PicarxClient(object):
+    ''' client of a PicarxDaemon
+
+    state() reads the shared-memory record without any system call;
+    the Picarx commands in COMMANDS are forwarded over the socket.
+    '''
+
+    def __init__(self, shm_name=SHM_NAME, socket_path=SOCKET_PATH):
+        self._state = SharedState(shm_name)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(socket_path)
+        self._file = self._sock.makefile('rb')
+        self._lock = threading.Lock()
+
+    def state(self):
+        return self._state.read()
+
+    def call(self, cmd, *args):
+        with self._lock:
+            self._sock.sendall(json.dumps({'cmd': cmd, 'args': args}).encode() + b'\n')
+            reply = json.loads(self._file.readline())
+        if not reply['ok']:
+            raise RuntimeError(reply['error'])
+        return reply['result']
+
+    def __getattr__(self, name):
+        if name in COMMANDS:
+            return lambda *args: self.call(name, *args)
+        raise AttributeError(name)
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+        self._state.close()
+
+
+def main():
+    from .picarx import Picarx
+    # before Picarx() resets the MCU under the running daemon
+    if daemon_running():
+        raise SystemExit("a Picarx daemon is already serving %s" % SOCKET_PATH)
+    daemon = PicarxDaemon(Picarx())
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+import bisect
+from collections import deque, namedtuple
+
+
+FilteredDistance = namedtuple('FilteredDistance', ['distance', 'raw', 'valid', 'outlier'])
+FilteredDistance.__doc__ = '''
+Output of DistanceFilter: the filtered distance in cm (None until the
+first valid reading), the raw reading, whether the raw reading was a
+usable echo and whether it was rejected as an outlier.
+'''
+
+
+class RunningMedian(object):
+    '''
+    Median of the last `window` values. The window is kept sorted, so
+    each update costs O(window), constant for a fixed small window.
+    '''
+
+    def __init__(self, window=5):
+        self.window = window
+        self._values = deque()
+        self._sorted = []
+
+    def __len__(self):
+        return len(self._values)
+
+    def add(self, value):
+        if len(self._values) == self.window:
+            old = self._values.popleft()
+            del self._sorted[bisect.bisect_left(self._sorted, old)]
+        self._values.append(value)
+        bisect.insort(self._sorted, value)
+        return self.median()
+
+    def median(self):
+        s = self._sorted
+        n = len(s)
+        if n == 0:
+            return None
+        if n % 2:
+            return s[n // 2]
+        return (s[n // 2 - 1] + s[n // 2]) / 2.0
+
+    def values(self):
+        return list(self._values)
+
+
+class DistanceFilter(object):
+    ''' streaming Hampel filter for ultrasonic ranges
+
+    Readings outside 0..max_range (the sensor's -1/-2 for no echo) are
+    flagged invalid and leave the filter state alone. A valid reading
+    more than `threshold` scaled MADs from the running median of the last
+    `window` readings is an outlier and is replaced by the median; it
+    still enters the window, so a real change in range is accepted once
+    it fills half of the window. min_deviation keeps a perfectly steady
+    window from rejecting every small change.
+    '''
+
+    MAD_SCALE = 1.4826  # MAD to standard deviation for normal noise
+
+    def __init__(self, window=7, threshold=3.0, min_deviation=2.0, max_range=400):
+        self.threshold = threshold
+        self.min_deviation = min_deviation
+        self.max_range = max_range
+        self._median = RunningMedian(window)
+        self.last = None
+
+    def reset(self):
+        self._median = RunningMedian(self._median.window)
+        self.last = None
+
+    def add(self, raw):
+        if raw is None or raw < 0 or raw > self.max_range:
+            return FilteredDistance(self.last, raw, False, False)
+        median = self._median.median()
+        outlier = False
+        if median is not None and len(self._median) >= 3:
+            mad = sorted(abs(v - median) for v in self._median.values())[len(self._median) // 2]
+            deviation = max(self.MAD_SCALE * mad, self.min_deviation)
+            outlier = abs(raw - median) > self.threshold * deviation
+        median = self._median.add(raw)
+        self.last = median if outlier else raw
+        return FilteredDistance(self.last, raw, True, outlier)
+
+
+class AdaptivePingScheduler(object):
+    ''' picks the interval until the next ultrasonic ping
+
+    Pings run at min_interval while the range is changing. While it holds
+    within static_tolerance between pings the interval is stretched by
+    `growth` per ping, up to a limit that rises from min_interval at
+    `near` cm to max_interval at `far` cm. A static scene far away is
+    pinged rarely, anything close or moving is pinged at full rate.
+    '''
+
+    def __init__(self, min_interval=0.02, max_interval=0.5, near=20, far=150,
+                 static_tolerance=2.0, growth=1.5):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.near = near
+        self.far = far
+        self.static_tolerance = static_tolerance
+        self.growth = growth
+        self._last = None
+        self.interval = min_interval
+
+    def limit(self, distance):
+        '''
+        Longest interval allowed at distance.
+        '''
+        if distance <= self.near:
+            return self.min_interval
+        if distance >= self.far:
+            return self.max_interval
+        fraction = (distance - self.near) / float(self.far - self.near)
+        return self.min_interval + fraction * (self.max_interval - self.min_interval)
+
+    def next_interval(self, distance):
+        '''
+        Seconds to wait after a ping that measured distance. None, no
+        echo, counts as `far`.
+        '''
+        if distance is None:
+            distance = self.far
+        if distance is not None and self._last is not None and \
+                abs(distance - self._last) <= self.static_tolerance:
+            self.interval = min(self.interval * self.growth, self.limit(distance))
+        else:
+            self.interval = self.min_interval
+        self._last = distance
+        return self.interval
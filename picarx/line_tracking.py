@@ -0,0 +1,163 @@
+import numpy as np
+
+
+class PID(object):
+    ''' PID controller with output clamping and integral anti-windup '''
+
+    def __init__(self, kp, ki=0.0, kd=0.0, output_limits=(None, None), integral_limit=None):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.output_limits = output_limits
+        self.integral_limit = integral_limit
+        self.reset()
+
+    def reset(self):
+        self.integral = 0.0
+        self._last_error = None
+
+    def update(self, error, dt):
+        if dt > 0:
+            self.integral += error * dt
+            if self.integral_limit is not None:
+                self.integral = max(-self.integral_limit, min(self.integral_limit, self.integral))
+        derivative = 0.0
+        if self._last_error is not None and dt > 0:
+            derivative = (error - self._last_error) / dt
+        self._last_error = error
+        output = self.kp * error + self.ki * self.integral + self.kd * derivative
+        low, high = self.output_limits
+        if low is not None and output < low:
+            output = low
+        if high is not None and output > high:
+            output = high
+        return output
+
+
+def line_weights(values, reference, contrast=300):
+    ''' how strongly each grayscale channel sees the line, 0 to 1
+
+    A channel reading exactly its line reference scores 0.5, one reading
+    `contrast` below it (darker, on the line) scores 1 and one reading
+    `contrast` above it (background) scores 0. Works on (3,) and (N, 3).
+    '''
+    values = np.asarray(values, dtype=float)
+    reference = np.asarray(reference, dtype=float)
+    return np.clip(0.5 + (reference - values) / (2.0 * contrast), 0.0, 1.0)
+
+
+def line_offset(values, reference, contrast=300):
+    ''' continuous line position under the sensor, -1 (left) to 1 (right)
+
+    Weighted centroid of the three channels at positions -1, 0 and 1.
+    return: offset, or NaN where no channel sees the line
+    '''
+    weights = line_weights(values, reference, contrast)
+    on_line = (weights >= 0.5).any(axis=-1)
+    total = weights.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        offset = (weights[..., 2] - weights[..., 0]) / total
+    return np.where(on_line, offset, np.nan)
+
+
+class LineTracker(object):
+    ''' PID line follower for Picarx
+
+    Every step reads the grayscale module once, estimates the line
+    offset with line_offset(), steers with a PID on it and slows down in
+    proportion to |offset|. Steering and speed go out together through
+    Picarx.drive().
+
+    When the line is lost the car backs up steering towards the side the
+    line was last seen on, as examples/5.minecart_plus.py does, but
+    without blocking: every step checks whether the line is back. After
+    lost_timeout seconds without the line it stops and reports 'lost'.
+
+    tracker = LineTracker(px, speed=30)
+    tracker.run(duration=60)
+    '''
+
+    TRACKING = 'tracking'
+    RECOVERING = 'recovering'
+    LOST = 'lost'
+
+    def __init__(self, px, speed=20, steer_pid=None, slowdown=0.5, contrast=300,
+                 recovery_speed=10, lost_timeout=2.0, frequency=100):
+        self.px = px
+        self.speed = speed
+        self.steer_pid = steer_pid if steer_pid is not None else \
+            PID(30.0, 0.0, 1.0, output_limits=(px.DIR_MIN, px.DIR_MAX), integral_limit=1.0)
+        self.slowdown = slowdown
+        self.contrast = contrast
+        self.recovery_speed = recovery_speed
+        self.lost_timeout = lost_timeout
+        self.frequency = frequency
+        self.clock = px.backend.clock
+        self.loop = px.control_loop(self.step, frequency)
+        self.reset()
+
+    def reset(self):
+        self.state = self.TRACKING
+        self.offset = 0.0
+        self.last_offset = 0.0
+        self.line_losses = 0
+        self._lost_since = None
+        self._last_time = None
+        self.steer_pid.reset()
+
+    def step(self):
+        now = self.clock.time()
+        dt = 0.0 if self._last_time is None else now - self._last_time
+        self._last_time = now
+        px = self.px
+        offset = float(line_offset(px.get_grayscale_data(), px.line_reference, self.contrast))
+
+        if offset == offset:  # not NaN: the line is in sight
+            if self.state != self.TRACKING:
+                self.steer_pid.reset()
+                dt = 0.0
+            self.state = self.TRACKING
+            self._lost_since = None
+            self.offset = self.last_offset = offset
+            steer = self.steer_pid.update(offset, dt)
+            speed = self.speed * (1.0 - self.slowdown * abs(offset))
+            px.drive(speed, steer)
+            return self.state
+
+        if self.state == self.TRACKING:
+            self.line_losses += 1
+            self._lost_since = now
+            self.state = self.RECOVERING
+        if self.state == self.RECOVERING:
+            if now - self._lost_since >= self.lost_timeout:
+                self.state = self.LOST
+                px.stop()
+            else:
+                # back up with the front swinging towards the line
+                side = 1 if self.last_offset >= 0 else -1
+                px.drive(-self.recovery_speed, -side * px.DIR_MAX)
+        return self.state
+
+    def run(self, iterations=None, duration=None):
+        ''' track in the calling thread at self.frequency Hz
+
+        Stops when the line has been lost for good, and stops the car.
+        '''
+        def step():
+            return self.step() != self.LOST
+        self.loop.step = step
+        try:
+            return self.loop.run(iterations, duration)
+        finally:
+            self.px.stop()
+
+    def start(self):
+        '''
+        Track in a background thread, see run().
+        '''
+        self.loop.step = self.step
+        self.loop.start()
+
+    def stop(self):
+        self.loop.stop()
+        self.px.stop()
@@ -0,0 +1,173 @@
+import threading
+import warnings
+
+from .clock import MonotonicClock, sleep_until
+
+
+class RunningStat(object):
+    '''
+    Count, mean, min and max of a stream of values in constant memory.
+    '''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def as_dict(self):
+        return {'count': self.count, 'mean': self.mean, 'min': self.min, 'max': self.max}
+
+
+class LoopStats(object):
+    '''
+    Timing statistics of a ControlLoop, all times in seconds.
+
+    jitter is how late each step started relative to its deadline,
+    duration is how long the step function ran, overruns counts steps
+    that ended past the next deadline and skipped counts periods that
+    were dropped to get back on schedule.
+    '''
+
+    def __init__(self):
+        self.jitter = RunningStat()
+        self.duration = RunningStat()
+        self.iterations = 0
+        self.overruns = 0
+        self.skipped = 0
+
+    def as_dict(self):
+        return {
+            'iterations': self.iterations,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'jitter': self.jitter.as_dict(),
+            'duration': self.duration.as_dict(),
+        }
+
+
+class ControlLoop(object):
+    ''' fixed-rate runner for a control step function
+
+    The step function is called with no arguments once per period, paced
+    with absolute deadlines so sleep and step time don't accumulate as
+    drift. Returning False from the step stops the loop.
+
+    Overrun policies, applied when a step ends past the next deadline:
+        'skip'     drop the missed periods and stay in phase
+        'catch_up' run the missed periods back to back
+        'warn'     like 'skip', but also issue a RuntimeWarning
+    '''
+
+    SKIP = 'skip'
+    CATCH_UP = 'catch_up'
+    WARN = 'warn'
+    POLICIES = (SKIP, CATCH_UP, WARN)
+
+    def __init__(self, step, frequency, overrun=SKIP, clock=None):
+        if overrun not in self.POLICIES:
+            raise ValueError("overrun must be one of %s" % (self.POLICIES,))
+        if frequency <= 0:
+            raise ValueError("frequency must be positive")
+        self.step = step
+        self.period = 1.0 / frequency
+        self.overrun = overrun
+        self.clock = clock if clock is not None else MonotonicClock()
+        self.stats = LoopStats()
+        self._running = threading.Event()
+        self._thread = None
+
+    @property
+    def frequency(self):
+        return 1.0 / self.period
+
+    @property
+    def running(self):
+        return self._running.is_set()
+
+    def run(self, iterations=None, duration=None):
+        ''' run the loop in the calling thread
+
+        param iterations: stop after this many steps, None for no limit
+        type iterations: int
+        param duration: stop after this many seconds, None for no limit
+        type duration: float
+        '''
+        clock = self.clock
+        stats = self.stats
+        period = self.period
+        self._running.set()
+        background = threading.current_thread() is self._thread
+        if background:
+            clock.follow()
+        deadline = clock.time()
+        end = None if duration is None else deadline + duration
+        count = 0
+        try:
+            while self._running.is_set():
+                if iterations is not None and count >= iterations:
+                    break
+                now = clock.time()
+                if deadline > now:
+                    if background:
+                        now = sleep_until(clock, deadline, self._running.is_set)
+                        if not self._running.is_set():
+                            break
+                    else:
+                        clock.sleep(deadline - now)
+                        now = clock.time()
+                if end is not None and now >= end:
+                    break
+                stats.jitter.add(now - deadline)
+                result = self.step()
+                finished = clock.time()
+                stats.duration.add(finished - now)
+                stats.iterations += 1
+                count += 1
+                if result is False:
+                    break
+                deadline += period
+                if finished > deadline:
+                    stats.overruns += 1
+                    if self.overrun != self.CATCH_UP:
+                        missed = int((finished - deadline) / period) + 1
+                        stats.skipped += missed
+                        deadline += missed * period
+                    if self.overrun == self.WARN:
+                        warnings.warn("control step overran its %.4fs period (took %.4fs)"
+                                      % (period, finished - now), RuntimeWarning)
+        finally:
+            self._running.clear()
+        return stats
+
+    def start(self, iterations=None, duration=None):
+        '''
+        Run the loop in a background thread.
+        '''
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._running.set()
+        self._thread = threading.Thread(target=self.run, args=(iterations, duration), name='picarx-loop')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running.clear()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,191 @@
+import math
+import threading
+from concurrent.futures import Future
+
+from .clock import sleep_until
+
+
+class MotionProfile(object):
+    ''' point to point motion with limited velocity and acceleration
+
+    shape 'trapezoidal' ramps with constant acceleration, 's_curve' ramps
+    with a half-cosine velocity blend so acceleration also starts and ends
+    at zero. Both reach the same peak acceleration, max_acceleration.
+    Falls back to a triangular profile when the move is too short to
+    reach max_velocity.
+    '''
+
+    TRAPEZOIDAL = 'trapezoidal'
+    S_CURVE = 's_curve'
+
+    def __init__(self, start, target, max_velocity, max_acceleration, shape=TRAPEZOIDAL):
+        if max_velocity <= 0 or max_acceleration <= 0:
+            raise ValueError("max_velocity and max_acceleration must be positive")
+        if shape == self.TRAPEZOIDAL:
+            k = 1.0
+        elif shape == self.S_CURVE:
+            k = math.pi / 2
+        else:
+            raise ValueError("shape must be '%s' or '%s'" % (self.TRAPEZOIDAL, self.S_CURVE))
+        self.start = start
+        self.target = target
+        self.shape = shape
+        distance = abs(target - start)
+        self._sign = 1 if target >= start else -1
+        self._distance = distance
+        # ramp time for a given peak velocity is k * v / a
+        velocity = max_velocity
+        if k * velocity * velocity / max_acceleration > distance:
+            velocity = math.sqrt(distance * max_acceleration / k)
+        self._velocity = velocity
+        self._ramp_time = k * velocity / max_acceleration if velocity else 0.0
+        ramp_distance = velocity * self._ramp_time / 2
+        self._cruise_time = (distance - 2 * ramp_distance) / velocity if velocity else 0.0
+        self.duration = 2 * self._ramp_time + self._cruise_time
+
+    def _ramp(self, t):
+        # distance covered t seconds into an acceleration ramp
+        ta = self._ramp_time
+        if self.shape == self.TRAPEZOIDAL:
+            return 0.5 * self._velocity / ta * t * t
+        return self._velocity / 2 * (t - ta / math.pi * math.sin(math.pi * t / ta))
+
+    def position(self, t):
+        '''
+        Position t seconds after the start of the move.
+        '''
+        if t <= 0:
+            return self.start
+        if t >= self.duration:
+            return self.target
+        ta = self._ramp_time
+        if t < ta:
+            covered = self._ramp(t)
+        elif t < ta + self._cruise_time:
+            covered = self._ramp(ta) + self._velocity * (t - ta)
+        else:
+            covered = self._distance - self._ramp(self.duration - t)
+        return self.start + self._sign * covered
+
+
+class _Axis(object):
+    def __init__(self, setter, getter, position):
+        self.setter = setter
+        self.getter = getter
+        self.position = position
+        self.profile = None
+        self.started = 0.0
+        self.future = None
+
+
+class MotionEngine(object):
+    ''' background interpolator for servos and motors
+
+    Each axis is a setter called with the interpolated value at `rate`
+    Hz, plus an optional getter for where the axis is when a move starts
+    from rest (otherwise the last interpolated value is used).
+
+    move() returns at once with a Future that resolves to the target
+    when the move completes, or is cancelled when a newer move on the
+    same axis replaces it. The thread sleeps while no move is active.
+    '''
+
+    def __init__(self, clock, rate=100):
+        self.clock = clock
+        self.rate = rate
+        self._axes = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._running = False
+        self._thread = None
+
+    def add_axis(self, name, setter, getter=None, position=0):
+        self._axes[name] = _Axis(setter, getter, position)
+
+    def position(self, name):
+        return self._axes[name].position
+
+    def move(self, name, target, max_velocity, max_acceleration, shape=MotionProfile.TRAPEZOIDAL):
+        axis = self._axes[name]
+        future = Future()
+        with self._lock:
+            if axis.profile is None and axis.getter is not None:
+                axis.position = axis.getter()
+            profile = MotionProfile(axis.position, target, max_velocity, max_acceleration, shape)
+            if axis.future is not None:
+                axis.future.cancel()
+            axis.profile = profile
+            axis.started = self.clock.time()
+            axis.future = future
+        self._ensure_thread()
+        self._wake.set()
+        return future
+
+    def cancel(self, name=None):
+        '''
+        Stop moving one axis, or all of them, where they are now.
+        '''
+        with self._lock:
+            for key, axis in self._axes.items():
+                if name is None or key == name:
+                    if axis.future is not None:
+                        axis.future.cancel()
+                    axis.profile = None
+                    axis.future = None
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._running = True
+            self._thread = threading.Thread(target=self._loop, name='picarx-motion')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def shutdown(self):
+        self.cancel()
+        self._running = False
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def tick(self):
+        '''
+        Advance every active move to the current clock time. Returns True
+        while any move is still in progress.
+        '''
+        now = self.clock.time()
+        active = False
+        done = []
+        with self._lock:
+            for axis in self._axes.values():
+                profile = axis.profile
+                if profile is None:
+                    continue
+                elapsed = now - axis.started
+                value = profile.position(elapsed)
+                axis.setter(value)
+                axis.position = value
+                if elapsed >= profile.duration:
+                    done.append((axis.future, profile.target))
+                    axis.profile = None
+                    axis.future = None
+                else:
+                    active = True
+        for future, target in done:
+            if future.set_running_or_notify_cancel():
+                future.set_result(target)
+        return active
+
+    def _loop(self):
+        clock = self.clock
+        clock.follow()
+        while self._running:
+            self._wake.wait()
+            self._wake.clear()
+            deadline = clock.time()
+            while self._running and self.tick():
+                deadline += 1.0 / self.rate
+                now = clock.time()
+                if deadline < now:
+                    deadline = now
+                sleep_until(clock, deadline, lambda: self._running)
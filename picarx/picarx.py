@@ -1,14 +1,41 @@
-from robot_hat import Pin, ADC, PWM, Servo, fileDB
-from robot_hat import Grayscale_Module, Ultrasonic, utils
-import time
+from .backend import RobotHatBackend
+from .ranging import UltrasonicRanger
+from .filters import DistanceFilter, AdaptivePingScheduler
+from .watchdog import CliffWatchdog
+from .sampler import GrayscaleSampler
+from .loop import ControlLoop
+from .motion import MotionEngine, MotionProfile
+from .calibration import Calibration, CalibrationStore
+from . import telemetry
+from .stats import LatencyHistogram, timed
 import os
+import getpass
 import atexit
+import threading
+from collections import namedtuple
+import numpy as np
+
+def _login_name():
+    try:
+        return os.getlogin()
+    except OSError:
+        # no controlling terminal, e.g. under systemd or CI
+        return getpass.getuser()
+
+SensorSnapshot = namedtuple('SensorSnapshot', [
+    'grayscale', 'grayscale_time', 'distance', 'distance_time',
+    'dir_angle', 'cam_pan_angle', 'cam_tilt_angle'])
+SensorSnapshot.__doc__ = '''
+Immutable view of the latest grayscale values (a tuple, None before the
+first read), the latest distance in cm (None before the first ping), the
+clock times they were read at and the current servo angles.
+'''
 
 class Picarx(object):
-    CONFIG = f'/home/{os.getlogin()}/.config/picarx/config.json'
+    CONFIG = f'/home/{_login_name()}/.config/picarx/config.json'
 
-    DEFAULT_LINE_REF = [1000, 1000, 1000]
-    DEFAULT_CLIFF_REF = [500, 500, 500]
+    DEFAULT_LINE_REF = Calibration.DEFAULT_LINE_REF
+    DEFAULT_CLIFF_REF = Calibration.DEFAULT_CLIFF_REF
 
     DIR_MIN = -30
     DIR_MAX = 30
@@ -20,78 +47,400 @@ class Picarx(object):
     PERIOD = 4095
     PRESCALER = 10
     TIMEOUT = 0.02
+
+    # angular step, in degrees, of the servo angle to pulse tables
+    SERVO_RESOLUTION = 0.1
+
+    # per-device locks, in the order they are taken together; the backend
+    # serializes the shared bus itself (RobotHatBackend.bus_lock)
+    LOCK_ORDER = ('dir', 'cam_pan', 'cam_tilt', 'motors', 'adc', 'ultrasonic')
     
     def __init__(self, 
             servo_pins:list=['P0', 'P1', 'P2'], 
             motor_pins:list=['D4', 'D5', 'P13', 'P12'],
             grayscale_pins:list=['A0', 'A1', 'A2'],
             ultrasonic_pins:list=['D2','D3'],
-            config:str=CONFIG):
+            config:str=CONFIG,
+            backend=None,
+            warm_start:bool=False,
+            calibration_profile:str=None,
+            servo_resolution:float=SERVO_RESOLUTION):
+        '''
+        warm_start=True is for restarting a control process on a car that
+        is already running: the MCU reset, the PWM setup and re-driving the
+        servos to their calibration angles are skipped, and the grayscale
+        module, ultrasonic sensor and camera servos are only created when
+        first used. self.startup_timings holds the seconds spent per stage.
+
+        calibration_profile selects a named profile in the config file,
+        by default the one that was active when it was last saved.
+
+        servo_resolution is the angular step, in degrees, of the tables
+        that map servo angles to PWM register values.
+
+        A Picarx may be shared between threads. Every device has its own
+        lock (self.locks: 'dir', 'cam_pan', 'cam_tilt', 'motors', 'adc',
+        'ultrasonic'), so sensing never waits for actuation and the servos
+        never wait for each other. Calls that need several devices take
+        their locks in that order.
+        '''
+        # --------- hardware backend ---------
+        self.backend = backend if backend is not None else RobotHatBackend()
+        self.locks = dict((name, threading.RLock()) for name in self.LOCK_ORDER)
+        self._lock_sets = {}
+        self._grayscale_reading = None
+        self._distance_reading = None
+        self.warm_start = warm_start
+        self.startup_timings = {}
+        started = t = self.backend.time()
 
         # reset robot_hat
-        utils.reset_mcu()
-        time.sleep(0.2)
+        if not warm_start:
+            self.backend.reset_mcu()
+            self.backend.sleep(0.2)
+            t = self._timed('reset', t)
 
         # --------- config_flie ---------
-        self.config_file = fileDB(config)
+        # the whole file is parsed once; changes are saved through
+        # self.calibration, batched with self.calibration.transaction()
+        self.calibration = CalibrationStore(self.backend, config, calibration_profile)
+        self.calibration.on_rollback = self._rollback_calibration
+        self.config_file = self.calibration
+        calibration = self.calibration.calibration
+        t = self._timed('config', t)
 
         # --------- servos init ---------
-        self.cam_pan = Servo(servo_pins[0])
-        self.cam_tilt = Servo(servo_pins[1])   
-        self.dir_servo_pin = Servo(servo_pins[2])
+        self._servo_pins = servo_pins
+        self._cam_pan = None
+        self._cam_tilt = None
+        self.dir_servo_pin = self.backend.servo(servo_pins[2])
+        self._servo_tables = {}
+        self._servo_resolution = servo_resolution
         
         # get calibration values
-        self.dir_cali_val = float(self.config_file.get("picarx_dir_servo", default_value=0)) # type: ignore
-        self.cam_pan_cali_val = float(self.config_file.get("picarx_cam_pan_servo", default_value=0)) # type: ignore
-        self.cam_tilt_cali_val = float(self.config_file.get("picarx_cam_tilt_servo", default_value=0)) # type: ignore
+        self.dir_cali_val = calibration.dir_servo
+        self.cam_pan_cali_val = calibration.cam_pan_servo
+        self.cam_tilt_cali_val = calibration.cam_tilt_servo
         #
+        # shadow copy of the last value written to each servo, PWM channel
+        # and direction pin, used to skip writes that change nothing
+        self.shadow_cache = True
+        self._shadow = {}
+
         # set servos to init angle
-        self.dir_servo_pin.angle(self.dir_cali_val)
-        self.cam_pan.angle(self.cam_pan_cali_val)
-        self.cam_tilt.angle(self.cam_tilt_cali_val)
+        if not warm_start:
+            self._flush([
+                self._servo_raw_write(self.dir_servo_pin, self.dir_cali_val),
+                self._servo_raw_write(self.cam_pan, self.cam_pan_cali_val),
+                self._servo_raw_write(self.cam_tilt, self.cam_tilt_cali_val),
+            ])
+        t = self._timed('servos', t)
 
         # --------- motors init ---------
-        self.left_rear_dir_pin = Pin(motor_pins[0])
-        self.right_rear_dir_pin = Pin(motor_pins[1])
-        self.left_rear_pwm_pin = PWM(motor_pins[2])
-        self.right_rear_pwm_pin = PWM(motor_pins[3])
+        self.left_rear_dir_pin = self.backend.pin(motor_pins[0])
+        self.right_rear_dir_pin = self.backend.pin(motor_pins[1])
+        self.left_rear_pwm_pin = self.backend.pwm(motor_pins[2])
+        self.right_rear_pwm_pin = self.backend.pwm(motor_pins[3])
         self.motor_direction_pins = [self.left_rear_dir_pin, self.right_rear_dir_pin]
         self.motor_speed_pins = [self.left_rear_pwm_pin, self.right_rear_pwm_pin]
         
         # get calibration values
-        self.cali_dir_value = self.config_file.get("picarx_dir_motor", default_value=[1, 1])
+        self.cali_dir_value = list(calibration.dir_motor)
         self.cali_speed_value = [0, 0]
         self.dir_current_angle = 0
+        self.cam_pan_current_angle = 0
+        self.cam_tilt_current_angle = 0
+        self.motion = None
+        self.recorder = None
+        self._stats = None
         # init pwm
-        for pin in self.motor_speed_pins:
-            pin.period(self.PERIOD)
-            pin.prescaler(self.PRESCALER)
+        if not warm_start:
+            for pin in self.motor_speed_pins:
+                pin.period(self.PERIOD)
+                pin.prescaler(self.PRESCALER)
+        t = self._timed('motors', t)
 
         # --------- grayscale module init ---------
-        adc0, adc1, adc2 = [ADC(pin) for pin in grayscale_pins]
-        self.grayscale = Grayscale_Module(adc0, adc1, adc2, reference=None)
+        self._grayscale_pins = grayscale_pins
+        self._grayscale = None
         # get reference
-        self.line_reference = self.config_file.get("line_reference", default_value=self.DEFAULT_LINE_REF)
-        
-        self.cliff_reference = self.config_file.get("cliff_reference", default_value=self.DEFAULT_CLIFF_REF)
-        # transfer reference
-        
-        self.grayscale.reference(self.line_reference)
+        self.line_reference = list(calibration.line_reference)
+        self.cliff_reference = list(calibration.cliff_reference)
+        self.grayscale_sampler = None
 
         # --------- ultrasonic init ---------
-        trig, echo= ultrasonic_pins
-        self.ultrasonic = Ultrasonic(Pin(trig), Pin(echo, mode=Pin.IN, pull=Pin.PULL_DOWN))
+        self._ultrasonic_pins = ultrasonic_pins
+        self._ultrasonic = None
+        self.ranger = None
+        self.distance_filter = None
+        self.cliff_watchdog = None
+
+        # a cold start creates the sensors up front, a warm start on first use
+        if not warm_start:
+            self.grayscale
+            self.ultrasonic
+        self.startup_timings['total'] = self.backend.time() - started
         
         @atexit.register
         def goodbye():
+            self.stop_cliff_watchdog()
+            self.stop_ranging()
+            self.stop_grayscale_stream()
+            if self.motion is not None:
+                self.motion.shutdown()
             self.stop()
+            self.stop_recording()
         
+    def _timed(self, stage, started):
+        now = self.backend.time()
+        self.startup_timings[stage] = now - started
+        return now
+
+    @property
+    def cam_pan(self):
+        if self._cam_pan is None:
+            with self.locks['cam_pan']:
+                if self._cam_pan is None:
+                    t = self.backend.time()
+                    self._cam_pan = self.backend.servo(self._servo_pins[0])
+                    self._timed('cam_pan', t)
+        return self._cam_pan
+
+    @property
+    def cam_tilt(self):
+        if self._cam_tilt is None:
+            with self.locks['cam_tilt']:
+                if self._cam_tilt is None:
+                    t = self.backend.time()
+                    self._cam_tilt = self.backend.servo(self._servo_pins[1])
+                    self._timed('cam_tilt', t)
+        return self._cam_tilt
+
+    @property
+    def grayscale(self):
+        if self._grayscale is None:
+            with self.locks['adc']:
+                if self._grayscale is None:
+                    t = self.backend.time()
+                    adc0, adc1, adc2 = [self.backend.adc(pin) for pin in self._grayscale_pins]
+                    grayscale = self.backend.grayscale_module(adc0, adc1, adc2, reference=None)
+                    # transfer reference
+                    grayscale.reference(self.line_reference)
+                    self._synchronize_read(grayscale, 'adc', self._publish_grayscale)
+                    self._grayscale = grayscale
+                    self._timed('grayscale', t)
+        return self._grayscale
+
+    @property
+    def ultrasonic(self):
+        if self._ultrasonic is None:
+            with self.locks['ultrasonic']:
+                if self._ultrasonic is None:
+                    t = self.backend.time()
+                    trig, echo= self._ultrasonic_pins
+                    ultrasonic = self.backend.ultrasonic(self.backend.pin(trig), self.backend.input_pin(echo))
+                    self._synchronize_read(ultrasonic, 'ultrasonic', self._publish_distance)
+                    self._ultrasonic = ultrasonic
+                    self._timed('ultrasonic', t)
+        return self._ultrasonic
+
+    def _synchronize_read(self, device, lock, publish):
+        '''
+        Make device.read() take its device lock, whoever calls it (the
+        background samplers hold the device, not the Picarx), and publish
+        every value it returns for snapshot().
+        '''
+        read = device.read
+        lock = self.locks[lock]
+        clock = self.backend.clock
+
+        def locked_read(*args, **kwargs):
+            with lock:
+                value = read(*args, **kwargs)
+            publish(value, clock.time())
+            return value
+        locked_read.__wrapped__ = read
+        device.read = locked_read
+
+    def _publish_grayscale(self, value, timestamp):
+        # a single reference swap, so readers never see a torn reading
+        self._grayscale_reading = (tuple(value), timestamp)
+
+    def _publish_distance(self, value, timestamp):
+        self._distance_reading = (value, timestamp)
+
+    def _acquire(self, *names):
+        ''' hold several device locks, always taken in LOCK_ORDER '''
+        locks = self._lock_sets.get(names)
+        if locks is None:
+            locks = _Locks([self.locks[name] for name in self.LOCK_ORDER if name in names])
+            self._lock_sets[names] = locks
+        return locks
+
+    def snapshot(self):
+        ''' latest sensor values and servo angles, without locks or bus access
+
+        Built from the last values any thread read, so sensing threads and
+        actuation threads never serialize on each other. While background
+        ranging runs, distance is the range it published.
+
+        return: SensorSnapshot
+        '''
+        grayscale, grayscale_time = self._grayscale_reading or (None, None)
+        distance, distance_time = self._distance_reading or (None, None)
+        if self.ranger is not None:
+            reading = self.ranger.latest()
+            if reading is not None:
+                distance, distance_time = reading.distance, reading.timestamp
+        return SensorSnapshot(grayscale, grayscale_time, distance, distance_time,
+                              self.dir_current_angle, self.cam_pan_current_angle,
+                              self.cam_tilt_current_angle)
+
+    def control_loop(self, step, frequency, overrun=ControlLoop.SKIP):
+        '''
+        Build a ControlLoop that runs step() at frequency Hz on this car's clock.
+        '''
+        return ControlLoop(step, frequency, overrun=overrun, clock=self.backend.clock)
+
     def constrain(self, x, min_val, max_val):
         '''
         Constrains value to be within a range.
         '''
         return max(min_val, min(max_val, x))
         
+    def _flush(self, writes, force=False):
+        '''
+        Send a batch of (device, method, args) writes to the backend,
+        dropping those that would rewrite the value already in the shadow
+        cache. force=True writes everything regardless.
+        '''
+        if self.shadow_cache and not force:
+            shadow = self._shadow
+            writes = [w for w in writes if shadow.get((id(w[0]), w[1])) != w]
+        if writes:
+            self.backend.flush(writes)
+            for w in writes:
+                self._shadow[(id(w[0]), w[1])] = w
+
+    def invalidate_cache(self):
+        '''
+        Forget every shadowed value so the next write of each output goes
+        to the bus. Call this after utils.reset_mcu().
+        '''
+        self._shadow.clear()
+
+    def flush_cache(self):
+        '''
+        Rewrite every shadowed value to the hardware, e.g. to restore the
+        outputs after utils.reset_mcu().
+        '''
+        with self._acquire(*self.LOCK_ORDER):
+            self._flush(list(self._shadow.values()), force=True)
+
+    @property
+    def cali_dir_value(self):
+        return self._cali_dir_value
+
+    @cali_dir_value.setter
+    def cali_dir_value(self, value):
+        # the drive tables have the motor directions baked in
+        self._cali_dir_value = value
+        self._drive_tables = {}
+
+    # servo calibration offsets; the angle to pulse tables have them
+    # baked in, so changing one drops its table
+    @property
+    def dir_cali_val(self):
+        return self._dir_cali_val
+
+    @dir_cali_val.setter
+    def dir_cali_val(self, value):
+        self._dir_cali_val = value
+        self._servo_tables.pop('dir', None)
+
+    @property
+    def cam_pan_cali_val(self):
+        return self._cam_pan_cali_val
+
+    @cam_pan_cali_val.setter
+    def cam_pan_cali_val(self, value):
+        self._cam_pan_cali_val = value
+        self._servo_tables.pop('cam_pan', None)
+
+    @property
+    def cam_tilt_cali_val(self):
+        return self._cam_tilt_cali_val
+
+    @cam_tilt_cali_val.setter
+    def cam_tilt_cali_val(self, value):
+        self._cam_tilt_cali_val = value
+        self._servo_tables.pop('cam_tilt', None)
+
+    @property
+    def servo_resolution(self):
+        return self._servo_resolution
+
+    @servo_resolution.setter
+    def servo_resolution(self, value):
+        self._servo_resolution = value
+        self._servo_tables.clear()
+
+    def _servo_raw_write(self, servo, angle):
+        '''
+        Write for an uncalibrated servo angle, as a pulse width register value.
+        '''
+        return (servo, 'pulse_width', (self.backend.servo_pulse(angle),))
+
+    def _servo_write(self, name, value):
+        ''' write for a calibrated servo angle, from its lookup table
+
+        The table for each servo maps every angle in its range, at
+        servo_resolution steps, straight to the pulse width register
+        value with the calibration offset applied. value must already be
+        clamped to the servo's range.
+        '''
+        table = self._servo_tables.get(name)
+        if table is None:
+            table = self._build_servo_table(name)
+        low, resolution, servo, pulses = table
+        return (servo, 'pulse_width', (pulses[int((value - low) / resolution + 0.5)],))
+
+    def _build_servo_table(self, name):
+        resolution = self.servo_resolution
+        if name == 'dir':
+            servo, low, high = self.dir_servo_pin, self.DIR_MIN, self.DIR_MAX
+            raw = lambda angle: angle + self.dir_cali_val
+        elif name == 'cam_pan':
+            servo, low, high = self.cam_pan, self.CAM_PAN_MIN, self.CAM_PAN_MAX
+            raw = lambda angle: -1*(angle + -1*self.cam_pan_cali_val)
+        else:
+            servo, low, high = self.cam_tilt, self.CAM_TILT_MIN, self.CAM_TILT_MAX
+            raw = lambda angle: -1*(angle + -1*self.cam_tilt_cali_val)
+        steps = int(round((high - low) / resolution))
+        pulses = [self.backend.servo_pulse(raw(round(low + i * resolution, 9))) for i in range(steps + 1)]
+        table = (low, resolution, servo, pulses)
+        self._servo_tables[name] = table
+        return table
+
+    def _motor_outputs(self, motor, speed):
+        '''
+        Compute the direction pin and PWM writes for one motor without
+        touching the bus. Returns a list of (device, method, args).
+        '''
+        motor -= 1
+        speed = self.constrain(speed, -100, 100) * self.cali_dir_value[motor]
+        abs_speed = int(abs(speed)) + 20
+        dir_pin = self.motor_direction_pins[motor]
+        return [
+            (dir_pin, 'value', (1 if speed < 0 else 0,)),
+            (self.motor_speed_pins[motor], 'pulse_width_percent', (abs_speed,)),
+        ]
+
+    def _motor_writes(self, motor, speed):
+        if self.recorder is not None:
+            self.recorder.record(telemetry.MOTOR, motor, self.constrain(speed, -100, 100))
+        return self._motor_outputs(motor, speed)
+
     def set_motor_speed(self, motor, speed):
         ''' set motor speed
         
@@ -100,15 +449,32 @@ class Picarx(object):
         param speed: speed
         type speed: int      
         '''
-        speed = self.constrain(speed, -100, 100)
-        motor -= 1
-        abs_speed = int(abs(speed)) + 20
-        if speed < 0:
-            self.motor_direction_pins[motor].high()
-            self.motor_speed_pins[motor].pulse_width_percent(abs_speed)
-        else:
-            self.motor_direction_pins[motor].low()
-            self.motor_speed_pins[motor].pulse_width_percent(abs_speed)
+        with self.locks['motors']:
+            self._flush(self._motor_writes(motor, speed))
+
+    def use_calibration_profile(self, profile):
+        '''
+        Switch to a named calibration profile and apply its values.
+        '''
+        with self._acquire(*self.LOCK_ORDER):
+            self._use_calibration(self.calibration.select(profile))
+
+    def _use_calibration(self, calibration):
+        self.dir_cali_val = calibration.dir_servo
+        self.cam_pan_cali_val = calibration.cam_pan_servo
+        self.cam_tilt_cali_val = calibration.cam_tilt_servo
+        self.cali_dir_value = list(calibration.dir_motor)
+        self.line_reference = list(calibration.line_reference)
+        self.cliff_reference = list(calibration.cliff_reference)
+        self.grayscale.reference(self.line_reference)
+        self.set_dir_servo_angle(self.dir_current_angle)
+        self.set_cam_pan_angle(self.cam_pan_current_angle)
+        self.set_cam_tilt_angle(self.cam_tilt_current_angle)
+
+    def _rollback_calibration(self, calibration):
+        # a failed calibration.transaction(): go back to what was saved
+        with self._acquire(*self.LOCK_ORDER):
+            self._use_calibration(calibration)
 
     def motor_speed_calibration(self, value):
         self.cali_speed_value = value
@@ -128,117 +494,438 @@ class Picarx(object):
         type value: int
         '''      
         motor -= 1
-        if value == 1:
-            self.cali_dir_value[motor] = 1
-        elif value == -1:
-            self.cali_dir_value[motor] = -1
-        self.config_file.set("picarx_dir_motor", self.cali_dir_value)
+        with self.locks['motors']:
+            cali_dir_value = list(self.cali_dir_value)
+            if value == 1:
+                cali_dir_value[motor] = 1
+            elif value == -1:
+                cali_dir_value[motor] = -1
+        # the store first, so a rolled back transaction can restore the car;
+        # saving it must not hold up the motors
+        self.calibration.update(dir_motor=cali_dir_value)
+        with self.locks['motors']:
+            self.cali_dir_value = cali_dir_value
 
     def dir_servo_calibrate(self, value):
-        self.dir_cali_val = value
-        self.config_file.set("picarx_dir_servo", "%s"%value)
-        self.dir_servo_pin.angle(value)
+        self.calibration.update(dir_servo=value)
+        with self.locks['dir']:
+            self.dir_cali_val = value
+            self._flush([self._servo_raw_write(self.dir_servo_pin, value)])
 
     def set_dir_servo_angle(self, value):
-        self.dir_current_angle = self.constrain(value, self.DIR_MIN, self.DIR_MAX)
-        angle_value  = self.dir_current_angle + self.dir_cali_val
-        self.dir_servo_pin.angle(angle_value)
+        value = self.constrain(value, self.DIR_MIN, self.DIR_MAX)
+        with self.locks['dir']:
+            self.dir_current_angle = value
+            if self.recorder is not None:
+                self.recorder.record(telemetry.SERVO, telemetry.DIR_SERVO, value)
+            self._flush([self._servo_write('dir', value)])
 
     def cam_pan_servo_calibrate(self, value):
-        self.cam_pan_cali_val = value
-        self.config_file.set("picarx_cam_pan_servo", "%s"%value)
-        self.cam_pan.angle(value)
+        self.calibration.update(cam_pan_servo=value)
+        with self.locks['cam_pan']:
+            self.cam_pan_cali_val = value
+            self._flush([self._servo_raw_write(self.cam_pan, value)])
 
     def cam_tilt_servo_calibrate(self, value):
-        self.cam_tilt_cali_val = value
-        self.config_file.set("picarx_cam_tilt_servo", "%s"%value)
-        self.cam_tilt.angle(value)
+        self.calibration.update(cam_tilt_servo=value)
+        with self.locks['cam_tilt']:
+            self.cam_tilt_cali_val = value
+            self._flush([self._servo_raw_write(self.cam_tilt, value)])
 
     def set_cam_pan_angle(self, value):
         value = self.constrain(value, self.CAM_PAN_MIN, self.CAM_PAN_MAX)
-        self.cam_pan.angle(-1*(value + -1*self.cam_pan_cali_val))
+        with self.locks['cam_pan']:
+            self.cam_pan_current_angle = value
+            if self.recorder is not None:
+                self.recorder.record(telemetry.SERVO, telemetry.CAM_PAN, value)
+            self._flush([self._servo_write('cam_pan', value)])
 
     def set_cam_tilt_angle(self,value):
         value = self.constrain(value, self.CAM_TILT_MIN, self.CAM_TILT_MAX)
-        self.cam_tilt.angle(-1*(value + -1*self.cam_tilt_cali_val))
+        with self.locks['cam_tilt']:
+            self.cam_tilt_current_angle = value
+            if self.recorder is not None:
+                self.recorder.record(telemetry.SERVO, telemetry.CAM_TILT, value)
+            self._flush([self._servo_write('cam_tilt', value)])
 
     def set_power(self, speed):
-        self.set_motor_speed(1, speed)
-        self.set_motor_speed(2, speed)
+        with self.locks['motors']:
+            self._flush(self._motor_writes(1, speed) + self._motor_writes(2, speed))
 
-    def backward(self, speed):
-        current_angle = self.dir_current_angle
+    def _backward_speeds(self, speed, current_angle):
         if current_angle != 0:
             abs_current_angle = abs(current_angle)
             if abs_current_angle > self.DIR_MAX:
                 abs_current_angle = self.DIR_MAX
             power_scale = (100 - abs_current_angle) / 100.0 
             if (current_angle / abs_current_angle) > 0:
-                self.set_motor_speed(1, -1*speed)
-                self.set_motor_speed(2, speed * power_scale)
+                return -1*speed, speed * power_scale
             else:
-                self.set_motor_speed(1, -1*speed * power_scale)
-                self.set_motor_speed(2, speed )
+                return -1*speed * power_scale, speed
         else:
-            self.set_motor_speed(1, -1*speed)
-            self.set_motor_speed(2, speed)  
+            return -1*speed, speed
 
-    def forward(self, speed):
-        current_angle = self.dir_current_angle
+    def _forward_speeds(self, speed, current_angle):
         if current_angle != 0:
             abs_current_angle = abs(current_angle)
             if abs_current_angle > self.DIR_MAX:
                 abs_current_angle = self.DIR_MAX
             power_scale = (100 - abs_current_angle) / 100.0
             if (current_angle / abs_current_angle) > 0:
-                self.set_motor_speed(1, 1*speed * power_scale)
-                self.set_motor_speed(2, -speed) 
+                return 1*speed * power_scale, -speed
             else:
-                self.set_motor_speed(1, speed)
-                self.set_motor_speed(2, -1*speed * power_scale)
+                return speed, -1*speed * power_scale
+        else:
+            return speed, -1*speed
+
+    def _drive_table(self, backward, angle):
+        '''
+        Drive mixer for one integer steering angle, compiled into a list
+        indexed by speed + 100 of (left, right, motor writes). Built on
+        first use and dropped whenever cali_dir_value changes.
+        '''
+        table = self._drive_tables.get((backward, angle))
+        if table is None:
+            mix = self._backward_speeds if backward else self._forward_speeds
+            table = []
+            for speed in range(-100, 101):
+                left, right = mix(speed, angle)
+                left = self.constrain(left, -100, 100)
+                right = self.constrain(right, -100, 100)
+                table.append((left, right, self._motor_outputs(1, left) + self._motor_outputs(2, right)))
+            self._drive_tables[(backward, angle)] = table
+        return table
+
+    def _drive_writes(self, backward, speed, angle):
+        if type(speed) is int and -100 <= speed <= 100 and type(angle) is int:
+            left, right, writes = self._drive_table(backward, angle)[speed + 100]
         else:
-            self.set_motor_speed(1, speed)
-            self.set_motor_speed(2, -1*speed)                  
+            mix = self._backward_speeds if backward else self._forward_speeds
+            left, right = mix(speed, angle)
+            writes = self._motor_outputs(1, left) + self._motor_outputs(2, right)
+        if self.recorder is not None:
+            self.recorder.record(telemetry.MOTOR, 1, self.constrain(left, -100, 100))
+            self.recorder.record(telemetry.MOTOR, 2, self.constrain(right, -100, 100))
+        return writes
+
+    def backward(self, speed):
+        # the steering angle must not change between mixing and writing
+        with self._acquire('dir', 'motors'):
+            self._flush(self._drive_writes(True, speed, self.dir_current_angle))
+
+    def forward(self, speed):
+        with self._acquire('dir', 'motors'):
+            self._flush(self._drive_writes(False, speed, self.dir_current_angle))
+
+    def drive(self, speed, steer):
+        ''' steer and drive in one batched write
+
+        Every output (steering servo, both direction pins and both PWM
+        channels) is computed first and then flushed to the backend as a
+        single batch, so the wheels and steering update together.
+
+        param speed: speed, positive drives forward, negative backward
+        type speed: int
+        param steer: steering angle, clamped to DIR_MIN..DIR_MAX
+        type steer: int
+        '''
+        steer = self.constrain(steer, self.DIR_MIN, self.DIR_MAX)
+        with self._acquire('dir', 'motors'):
+            self.dir_current_angle = steer
+            if self.recorder is not None:
+                self.recorder.record(telemetry.SERVO, telemetry.DIR_SERVO, steer)
+            writes = [self._servo_write('dir', steer)]
+            if speed < 0:
+                writes += self._drive_writes(True, -speed, steer)
+            else:
+                writes += self._drive_writes(False, speed, steer)
+            self._flush(writes)
+
+    def move(self, axis, target, max_velocity, max_acceleration, shape=MotionProfile.TRAPEZOIDAL):
+        ''' move an axis to target along a motion profile, without blocking
+
+        The move is interpolated by a background MotionEngine at 100 Hz.
+
+        param axis: 'dir', 'cam_pan', 'cam_tilt' (degrees) or 'speed' (drive
+                    speed at the current steering angle, negative is backward)
+        type axis: str
+        param max_velocity: degrees or speed units per second
+        param max_acceleration: degrees or speed units per second squared
+        param shape: 'trapezoidal' or 's_curve'
+        return: concurrent.futures.Future resolving to target when done
+        '''
+        if self.motion is None:
+            motion = MotionEngine(self.backend.clock)
+            motion.add_axis('dir', self.set_dir_servo_angle, lambda: self.dir_current_angle)
+            motion.add_axis('cam_pan', self.set_cam_pan_angle, lambda: self.cam_pan_current_angle)
+            motion.add_axis('cam_tilt', self.set_cam_tilt_angle, lambda: self.cam_tilt_current_angle)
+            motion.add_axis('speed', lambda speed: self.drive(speed, self.dir_current_angle))
+            self.motion = motion
+        return self.motion.move(axis, target, max_velocity, max_acceleration, shape)
+
+    def stop_motors(self):
+        '''
+        Cut both motor PWMs with a single forced write, without waiting.
+        '''
+        with self.locks['motors']:
+            self._flush([
+                (self.motor_speed_pins[0], 'pulse_width_percent', (0,)),
+                (self.motor_speed_pins[1], 'pulse_width_percent', (0,)),
+            ], force=True)
+            if self.recorder is not None:
+                self.recorder.record(telemetry.MOTOR, 1, 0)
+                self.recorder.record(telemetry.MOTOR, 2, 0)
 
     def stop(self):
         '''
         Execute twice to make sure it stops
         '''
         for _ in range(2):
-            self.motor_speed_pins[0].pulse_width_percent(0)
-            self.motor_speed_pins[1].pulse_width_percent(0)
-            time.sleep(0.002)
+            self.stop_motors()
+            self.backend.sleep(0.002)
+
+    def start_cliff_watchdog(self, rate=200, on_cliff=None):
+        ''' guard against cliffs from a background thread
+
+        See CliffWatchdog: it samples the grayscale module at rate Hz and
+        stops the motors itself the moment a cliff appears, then calls
+        on_cliff(values) from a separate thread.
+        '''
+        self.stop_cliff_watchdog()
+        self.cliff_watchdog = CliffWatchdog(self, rate, on_cliff)
+        self.cliff_watchdog.start()
+        return self.cliff_watchdog
+
+    def stop_cliff_watchdog(self):
+        if self.cliff_watchdog is not None:
+            self.cliff_watchdog.stop()
+            self.cliff_watchdog = None
+
+    def get_distance(self, times=10):
+        '''
+        Distance in cm, -1 for no echo after `times` pings. While background ranging is running
+        this returns the latest published range instead of pinging, and -1
+        if its filter found the last ping unusable. A range older than the
+        ranger's max_age, e.g. while its pings fail, is not served: the
+        sensor is pinged directly instead.
+        '''
+        distance = None
+        if self.ranger is not None:
+            reading = self.ranger.latest()
+            if reading is not None and reading.age <= self.ranger.max_age:
+                distance = reading.distance if reading.valid else -1
+        if distance is None:
+            distance = self.ultrasonic.read(times)
+        if self.recorder is not None:
+            self.recorder.record(telemetry.DISTANCE, 0, distance)
+        return distance
+
+    def get_distance_filtered(self):
+        ''' ping once and pass the reading through self.distance_filter
+
+        return: FilteredDistance(distance, raw, valid, outlier); distance
+                holds the last good value while readings are invalid
+        '''
+        if self.distance_filter is None:
+            self.distance_filter = DistanceFilter()
+        return self.distance_filter.add(self.get_distance())
+
+    def get_distance_nowait(self):
+        '''
+        Latest DistanceReading(distance, timestamp, age) from background
+        ranging without touching the sensor, or None if nothing has been
+        measured yet. Requires start_ranging().
+        '''
+        if self.ranger is None:
+            raise RuntimeError("background ranging is not running, call start_ranging() first")
+        return self.ranger.latest()
 
-    def get_distance(self):
-        return self.ultrasonic.read()
+    def start_ranging(self, rate=20, filter=False, adaptive=False):
+        ''' start pinging the ultrasonic sensor in a background thread
+
+        param rate: pings per second
+        type rate: float
+        param filter: True or a DistanceFilter to publish filtered ranges
+        param adaptive: True or an AdaptivePingScheduler to ping less often
+                        while the scene is static and far away; rate is
+                        then ignored
+        '''
+        if filter is True:
+            filter = DistanceFilter()
+        if adaptive is True:
+            adaptive = AdaptivePingScheduler()
+        self.stop_ranging()
+        self.ranger = UltrasonicRanger(self.ultrasonic, self.backend.clock, rate,
+                                       filter or None, adaptive or None)
+        self.ranger.start()
+
+    def _instrumented(self):
+        # (name, object, method) of every instrumented hot path
+        return [
+            ('set_motor_speed', self, 'set_motor_speed'),
+            ('left_motor.pulse_width_percent', self.left_rear_pwm_pin, 'pulse_width_percent'),
+            ('right_motor.pulse_width_percent', self.right_rear_pwm_pin, 'pulse_width_percent'),
+            ('dir_servo.pulse_width', self.dir_servo_pin, 'pulse_width'),
+            ('cam_pan.pulse_width', self.cam_pan, 'pulse_width'),
+            ('cam_tilt.pulse_width', self.cam_tilt, 'pulse_width'),
+            ('grayscale.read', self.grayscale, 'read'),
+            ('ultrasonic.read', self.ultrasonic, 'read'),
+        ]
+
+    def enable_stats(self):
+        ''' start recording per-call latency histograms
+
+        Wraps set_motor_speed, the motor PWM writes, every servo pulse
+        width write, grayscale.read() and ultrasonic.read() with a timer. Nothing
+        is wrapped while stats are disabled, so they cost nothing then.
+        '''
+        if self._stats is not None:
+            return
+        self._stats = {}
+        self._unwrapped = {}
+        for name, obj, method in self._instrumented():
+            histogram = self._stats[name] = LatencyHistogram()
+            self._unwrapped[name] = obj.__dict__.get(method)
+            setattr(obj, method, timed(getattr(obj, method), histogram))
+
+    def disable_stats(self):
+        if self._stats is None:
+            return
+        for name, obj, method in self._instrumented():
+            # put back what was there, the device locks wrap read()
+            unwrapped = self._unwrapped.get(name)
+            if unwrapped is not None:
+                setattr(obj, method, unwrapped)
+            else:
+                obj.__dict__.pop(method, None)
+        self._stats = None
+
+    def stats(self, reset=False):
+        ''' latency snapshot of every instrumented call, in microseconds
+
+        param reset: clear the histograms after taking the snapshot
+        return: {name: {'count', 'mean_us', 'min_us', 'p50_us', ...}}, or
+                {} while stats are disabled
+        '''
+        if self._stats is None:
+            return {}
+        snapshot = dict((name, h.snapshot()) for name, h in self._stats.items())
+        if reset:
+            self.reset_stats()
+        return snapshot
+
+    def reset_stats(self):
+        for histogram in (self._stats or {}).values():
+            histogram.reset()
+
+    def start_recording(self, sink, capacity=4096):
+        ''' log every actuator command and sensor reading
+
+        Motor speeds, servo angles, grayscale data and distances are
+        recorded with clock timestamps in the fixed-width binary format of
+        telemetry.Recorder; load a recording with read_telemetry().
+
+        param sink: path or binary file object to write to
+        param capacity: records per buffer
+        '''
+        self.stop_recording()
+        self.recorder = telemetry.Recorder(sink, self.backend.clock, capacity)
+        return self.recorder
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            recorder, self.recorder = self.recorder, None
+            recorder.close()
+
+    def stop_ranging(self):
+        if self.ranger is not None:
+            self.ranger.stop()
+            self.ranger = None
 
     def set_grayscale_reference(self, value):
         if isinstance(value, list) and len(value) == 3:
+            self.calibration.update(line_reference=value)
             self.line_reference = value
-            self.grayscale.reference(self.line_reference)
-            self.config_file.set("line_reference", self.line_reference)
+            with self.locks['adc']:
+                self.grayscale.reference(self.line_reference)
         else:
             raise ValueError("grayscale reference must be a 1*3 list")
 
     def get_grayscale_data(self):
-        return list.copy(self.grayscale.read())
+        '''
+        Latest [left, middle, right] grayscale values. While streaming is
+        running this returns the newest sample instead of reading the ADCs,
+        unless it is older than the sampler's max_age, e.g. while its reads
+        fail.
+        '''
+        data = None
+        sampler = self.grayscale_sampler
+        if sampler is not None:
+            latest = sampler.latest()
+            if latest is not None and self.backend.clock.time() - latest[1] <= sampler.max_age:
+                data = latest[0].tolist()
+        if data is None:
+            data = list.copy(self.grayscale.read())
+        if self.recorder is not None:
+            self.recorder.record(telemetry.GRAYSCALE, 0, *data)
+        return data
+
+    def start_grayscale_stream(self, rate=100, size=256):
+        ''' start sampling the grayscale module in a background thread
+
+        The samples are kept in self.grayscale_sampler, see
+        GrayscaleSampler.latest(), window() and view().
+
+        param rate: samples per second
+        type rate: float
+        param size: number of samples kept in the ring buffer
+        type size: int
+        '''
+        if self.grayscale_sampler is None:
+            self.grayscale_sampler = GrayscaleSampler(self.grayscale, self.backend.clock, rate, size)
+        self.grayscale_sampler.rate = rate
+        self.grayscale_sampler.start()
+        return self.grayscale_sampler
+
+    def stop_grayscale_stream(self):
+        if self.grayscale_sampler is not None:
+            self.grayscale_sampler.stop()
+            self.grayscale_sampler = None
+
+    def get_line_status_array(self, samples):
+        ''' line status of many grayscale samples at once
+
+        param samples: grayscale values, shape (N, 3) or (3,)
+        type samples: array_like
+        return: bool array of shape (N, 3), True where the channel reads
+                at or below line_reference, i.e. sees the dark line; as
+                ints this is read_status(): 1 means line, 0 background
+        '''
+        return np.atleast_2d(samples) <= np.asarray(self.line_reference)
 
     def get_line_status(self,gm_val_list):
-        return self.grayscale.read_status(gm_val_list)
+        return self.get_line_status_array(gm_val_list)[0].astype(int).tolist()
 
     def set_line_reference(self, value):
         self.set_grayscale_reference(value)
 
+    def get_cliff_status_array(self, samples):
+        ''' cliff status of many grayscale samples at once
+
+        param samples: grayscale values, shape (N, 3) or (3,)
+        type samples: array_like
+        return: bool array of shape (N,), True where any channel reads at
+                or below cliff_reference
+        '''
+        return (np.atleast_2d(samples) <= np.asarray(self.cliff_reference)).any(axis=1)
+
     def get_cliff_status(self,gm_val_list):
-        for i in range(0,3):
-            if gm_val_list[i]<=self.cliff_reference[i]:
-                return True
-        return False
+        return bool(self.get_cliff_status_array(gm_val_list)[0])
 
     def set_cliff_reference(self, value):
         if isinstance(value, list) and len(value) == 3:
+            self.calibration.update(cliff_reference=value)
             self.cliff_reference = value
-            self.config_file.set("cliff_reference", self.cliff_reference)
         else:
             raise ValueError("grayscale reference must be a 1*3 list")
 
@@ -246,4 +933,19 @@ class Picarx(object):
         self.stop()
         self.set_dir_servo_angle(0)
         self.set_cam_tilt_angle(0)
-        self.set_cam_pan_angle(0)
\ No newline at end of file
+        self.set_cam_pan_angle(0)
+
+
+class _Locks(object):
+    ''' context manager holding several locks, released in reverse '''
+
+    def __init__(self, locks):
+        self.locks = locks
+
+    def __enter__(self):
+        for lock in self.locks:
+            lock.acquire()
+
+    def __exit__(self, *exc):
+        for lock in reversed(self.locks):
+            lock.release()
\ No newline at end of file
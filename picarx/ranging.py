@@ -0,0 +1,137 @@
+import threading
+import warnings
+from collections import namedtuple
+
+from .clock import sleep_until
+
+
+DistanceReading = namedtuple('DistanceReading', ['distance', 'timestamp', 'age', 'valid'])
+DistanceReading.__new__.__defaults__ = (True,)
+DistanceReading.__doc__ = '''
+Latest ultrasonic range in cm (-1 for no echo), the clock time it was
+measured at, its age in seconds when it was fetched and, with a filter,
+whether the last ping gave a usable echo; an invalid reading holds the
+raw value.
+'''
+
+# a reading older than this many ping periods is stale
+STALE_PERIODS = 3
+
+
+class UltrasonicRanger(object):
+    '''
+    Background thread that pings the ultrasonic sensor at a fixed rate
+    and publishes the latest range, so readers never wait for an echo.
+
+    With a DistanceFilter the published range is the filtered one, and
+    with an AdaptivePingScheduler the scheduler picks the ping interval
+    instead of the fixed rate.
+
+    A failed ping is kept in `error`, counted in `errors` and reported
+    with a RuntimeWarning, and the thread pings again next period. Nothing
+    is published meanwhile, so the latest reading ages past `max_age`.
+    '''
+
+    def __init__(self, ultrasonic, clock, rate=20, filter=None, scheduler=None):
+        self.ultrasonic = ultrasonic
+        self.clock = clock
+        self.rate = rate
+        self.filter = filter
+        self.scheduler = scheduler
+        self.pings = 0
+        self.errors = 0
+        self.error = None
+        self._ping_time = 0.0
+        self._latest = None
+        self._running = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._running.is_set()
+
+    @property
+    def period(self):
+        '''
+        Current interval between pings, in seconds.
+        '''
+        if self.scheduler is not None:
+            return self.scheduler.interval
+        return 1.0 / self.rate
+
+    @property
+    def max_age(self):
+        '''
+        Age in seconds past which the latest reading is stale: STALE_PERIODS
+        periods, each with as long a ping as the last one.
+        '''
+        return STALE_PERIODS * (self.period + self._ping_time)
+
+    def start(self):
+        if self.running:
+            return
+        self._running.set()
+        self._thread = threading.Thread(target=self._loop, name='picarx-ranging')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def latest(self):
+        '''
+        Return the latest DistanceReading, or None before the first ping.
+        '''
+        latest = self._latest
+        if latest is None:
+            return None
+        distance, timestamp, valid = latest
+        return DistanceReading(distance, timestamp, self.clock.time() - timestamp, valid)
+
+    def publish(self, distance):
+        '''
+        Publish a raw reading, through the filter if there is one, and
+        return the published distance. A reading the filter rejects as no
+        echo or out of range is published as it is, with valid=False, so
+        readers see open space instead of the last obstacle.
+        '''
+        valid = True
+        if self.filter is not None:
+            filtered = self.filter.add(distance)
+            valid = filtered.valid
+            if valid:
+                distance = filtered.distance
+        # a single tuple assignment, so readers never see a torn reading
+        self._latest = (distance, self.clock.time(), valid)
+        return distance
+
+    def _loop(self):
+        clock = self.clock
+        clock.follow()
+        deadline = clock.time()
+        while self._running.is_set():
+            started = clock.time()
+            try:
+                raw = self.ultrasonic.read()
+            except Exception as e:
+                self.errors += 1
+                self.error = e
+                warnings.warn("ultrasonic ping failed: %r" % e, RuntimeWarning)
+                raw = None
+            self._ping_time = clock.time() - started
+            if raw is not None:
+                self.publish(raw)
+                self.pings += 1
+                if self.scheduler is not None:
+                    # schedule on the raw range: a suspicious jump gets
+                    # confirmed quickly instead of being filtered away
+                    self.scheduler.next_interval(raw if raw >= 0 else None)
+            deadline += self.period
+            now = clock.time()
+            if deadline < now:
+                # a slow echo ate the slot; don't try to catch up
+                deadline = now
+            sleep_until(clock, deadline, self._running.is_set)
@@ -0,0 +1,114 @@
+import numpy as np
+
+from . import telemetry
+from .calibration import Calibration
+from .picarx import Picarx
+from .sim import SimBackend
+
+
+class CommandCapture(object):
+    '''
+    Recorder stand-in that keeps actuator commands in memory and ignores
+    sensor records, for collecting what a replayed step function did.
+    '''
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.records = []
+
+    def record(self, kind, channel=0, v0=0.0, v1=0.0, v2=0.0):
+        if kind == telemetry.MOTOR or kind == telemetry.SERVO:
+            self.records.append((self.clock.time(), kind, channel, b'', (v0, v1, v2)))
+
+    def close(self):
+        pass
+
+    def to_array(self):
+        return np.array(self.records, dtype=telemetry.RECORD_DTYPE)
+
+
+def diff_commands(a, b, atol=1e-3):
+    ''' compare two command arrays from Replay.run()
+
+    Timestamps are ignored, commands are compared in order.
+    return: index of the first differing command, or None if they match
+    '''
+    n = min(len(a), len(b))
+    same = (a['kind'][:n] == b['kind'][:n]) & (a['channel'][:n] == b['channel'][:n]) & \
+        np.all(np.isclose(a['values'][:n], b['values'][:n], atol=atol), axis=1)
+    if not same.all():
+        return int(np.argmin(same))
+    if len(a) != len(b):
+        return n
+    return None
+
+
+class Replay(object):
+    ''' re-run control code against recorded sensor data
+
+    The recording's grayscale and distance records are served back through
+    a Picarx on a SimBackend: before every tick the virtual clock is set
+    to the tick's recorded time and the sensors to the latest recorded
+    values, then step(px) is called. Ticks are the recorded grayscale
+    samples, or the distance samples if there are none. Nothing sleeps,
+    so hours of data replay as fast as the step function runs.
+
+    calibration gives the replay car the recording car's calibration,
+    e.g. its line and cliff references: a Calibration, or the dict of
+    its config file as Backend.read_config() returns it. Without it the
+    replay car has the default calibration.
+
+    result = Replay('run.bin', calibration=config).run(line_follow_step)
+    '''
+
+    def __init__(self, recording, calibration=None, **picarx_kwargs):
+        records = recording if isinstance(recording, np.ndarray) else telemetry.read_telemetry(recording)
+        kinds = records['kind']
+        self.records = records[(kinds == telemetry.GRAYSCALE) | (kinds == telemetry.DISTANCE)]
+        ticks = self.records['kind'] == telemetry.GRAYSCALE
+        if not ticks.any():
+            ticks = self.records['kind'] == telemetry.DISTANCE
+        self._tick_index = np.flatnonzero(ticks)
+        if isinstance(calibration, Calibration):
+            calibration = calibration.to_dict()
+        self.calibration = calibration
+        self.picarx_kwargs = picarx_kwargs
+
+    def __len__(self):
+        return len(self._tick_index)
+
+    def run(self, step, limit=None):
+        ''' run step(px) once per recorded tick
+
+        Returning False from step ends the replay early.
+        param limit: maximum number of ticks
+        return: structured array of the motor and servo commands issued,
+                in telemetry.RECORD_DTYPE
+        '''
+        backend = SimBackend()
+        if self.calibration is not None:
+            config = self.picarx_kwargs.get('config', Picarx.CONFIG)
+            backend.config_data[config] = self.calibration
+        px = Picarx(backend=backend, **self.picarx_kwargs)
+        capture = CommandCapture(backend.clock)
+        px.recorder = capture
+        records = self.records
+        timestamps = records['timestamp'].tolist()
+        kinds = records['kind'].tolist()
+        values = records['values'].tolist()
+        applied = 0
+        ticks = self._tick_index if limit is None else self._tick_index[:limit]
+        for index in ticks.tolist():
+            # apply every sensor record up to and including this tick
+            while applied <= index:
+                if kinds[applied] == telemetry.GRAYSCALE:
+                    backend.set_grayscale(values[applied])
+                else:
+                    distance = values[applied][0]
+                    backend.set_distance(None if distance < 0 else distance)
+                applied += 1
+            backend.clock.set(timestamps[index])
+            if step(px) is False:
+                break
+        px.recorder = None
+        return capture.to_array()
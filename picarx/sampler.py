@@ -0,0 +1,119 @@
+import threading
+import warnings
+import numpy as np
+
+from .clock import sleep_until
+
+# a sample older than this many sample periods is stale
+STALE_PERIODS = 3
+
+
+class GrayscaleSampler(object):
+    '''
+    Background thread that reads the three grayscale channels at a fixed
+    rate into a preallocated N*3 ring buffer with timestamps.
+
+    Every sample is stored twice, at i and i + size, so the last k samples
+    are always one contiguous slice and can be handed out without copying.
+
+    A failed read is kept in `error`, counted in `errors` and reported
+    with a RuntimeWarning, and the thread reads again next period. Nothing
+    is stored meanwhile, so the latest sample ages past `max_age`.
+    '''
+
+    def __init__(self, grayscale, clock, rate=100, size=256):
+        self.grayscale = grayscale
+        self.clock = clock
+        self.rate = rate
+        self.size = size
+        self._data = np.zeros((2 * size, 3), dtype=np.int32)
+        self._times = np.zeros(2 * size, dtype=np.float64)
+        self._head = 0  # index of the next slot to write
+        self.count = 0  # samples taken since start
+        self.errors = 0
+        self.error = None
+        self._running = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._running.is_set()
+
+    @property
+    def max_age(self):
+        '''
+        Age in seconds past which the latest sample is stale.
+        '''
+        return STALE_PERIODS / self.rate
+
+    def start(self):
+        if self.running:
+            return
+        self._running.set()
+        self._thread = threading.Thread(target=self._loop, name='picarx-grayscale')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def push(self, values, timestamp):
+        head = self._head
+        self._data[head] = values
+        self._data[head + self.size] = values
+        self._times[head] = timestamp
+        self._times[head + self.size] = timestamp
+        # publish only after the slot is fully written
+        self._head = (head + 1) % self.size
+        self.count += 1
+
+    def _loop(self):
+        clock = self.clock
+        clock.follow()
+        deadline = clock.time()
+        while self._running.is_set():
+            try:
+                self.push(self.grayscale.read(), clock.time())
+            except Exception as e:
+                self.errors += 1
+                self.error = e
+                warnings.warn("grayscale read failed: %r" % e, RuntimeWarning)
+            deadline += 1.0 / self.rate
+            now = clock.time()
+            if deadline < now:
+                deadline = now
+            sleep_until(clock, deadline, self._running.is_set)
+
+    def view(self, k=None):
+        ''' zero-copy view of the last k samples, oldest first
+
+        The arrays are live: the sampler keeps writing into the buffer, so
+        copy them if they must stay fixed.
+
+        param k: number of samples, default and maximum is the buffer size
+        type k: int
+        return: (values, timestamps), a k*3 array and a length k array
+        '''
+        available = min(self.count, self.size)
+        k = available if k is None else min(k, available)
+        end = self._head + self.size
+        return self._data[end - k:end], self._times[end - k:end]
+
+    def window(self, k=None):
+        '''
+        Copy of the last k samples and their timestamps, oldest first.
+        '''
+        values, times = self.view(k)
+        return values.copy(), times.copy()
+
+    def latest(self):
+        '''
+        The newest sample as (values, timestamp), or None before the first.
+        '''
+        if self.count == 0:
+            return None
+        i = self._head + self.size - 1
+        return self._data[i].copy(), self._times[i]
@@ -0,0 +1,254 @@
+import copy
+
+from .backend import Backend
+from .clock import VirtualClock
+
+
+class SimPin(object):
+    def __init__(self, backend, name):
+        self._backend = backend
+        self.name = name
+        self._value = 0
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._backend._write()
+        self._value = 1 if value else 0
+        return self._value
+
+    def high(self):
+        self.value(1)
+
+    def low(self):
+        self.value(0)
+
+    on = high
+    off = low
+
+
+class SimPWM(object):
+    def __init__(self, backend, channel):
+        self._backend = backend
+        self.channel = channel
+        self._period = 4095
+        self._prescaler = 1
+        self._pulse_width = 0
+
+    def period(self, value=None):
+        if value is None:
+            return self._period
+        self._backend._write()
+        self._period = int(value)
+
+    def prescaler(self, value=None):
+        if value is None:
+            return self._prescaler
+        self._backend._write()
+        self._prescaler = int(value)
+
+    def pulse_width(self, value=None):
+        if value is None:
+            return self._pulse_width
+        self._backend._write()
+        self._pulse_width = int(value)
+
+    def pulse_width_percent(self, value=None):
+        if value is None:
+            return self._pulse_width / self._period * 100.0
+        self.pulse_width(self._period * value / 100.0)
+
+
+class SimServo(SimPWM):
+    def __init__(self, backend, channel):
+        super().__init__(backend, channel)
+        self._angle = 0
+
+    def angle(self, value=None):
+        if value is None:
+            return self._angle
+        value = max(-90, min(90, value))
+        pulse_width_time = (value + 90) / 180.0 * 2000 + 500
+        self.pulse_width(pulse_width_time / 20000 * self._period)
+        self._angle = value
+
+    def pulse_width(self, value=None):
+        if value is not None:
+            # Picarx drives servos by pulse width; keep the angle in step
+            backend = self._backend
+            pulse_width_time = int(value) / self._period * backend.SERVO_FRAME
+            span = backend.SERVO_MAX_PW - backend.SERVO_MIN_PW
+            self._angle = round((pulse_width_time - backend.SERVO_MIN_PW) / span * 180.0 - 90, 1)
+        return SimPWM.pulse_width(self, value)
+
+
+class SimADC(object):
+    def __init__(self, backend, channel):
+        self._backend = backend
+        self.channel = channel
+        self.value = 0
+
+    def read(self):
+        self._backend._read(self._backend.adc_latency)
+        return int(self.value)
+
+
+class SimGrayscaleModule(object):
+    def __init__(self, adc0, adc1, adc2, reference=None):
+        self.pins = (adc0, adc1, adc2)
+        self._reference = reference
+
+    def reference(self, ref=None):
+        if ref is not None:
+            self._reference = list(ref)
+        return self._reference
+
+    def read(self):
+        return [adc.read() for adc in self.pins]
+
+    def read_status(self, datas=None):
+        if self._reference is None:
+            raise ValueError("Reference value is not set")
+        if datas is None:
+            datas = self.read()
+        return [0 if data > self._reference[i] else 1 for i, data in enumerate(datas)]
+
+
+class SimUltrasonic(object):
+    SOUND_SPEED = 343.3  # m/s
+
+    def __init__(self, backend, trig, echo, timeout=0.02):
+        self._backend = backend
+        self.trig = trig
+        self.echo = echo
+        self.timeout = timeout
+
+    def _read(self):
+        clock = self._backend.clock
+        clock.sleep(0.001)
+        distance = self._backend.distance
+        if distance is None:
+            clock.sleep(self.timeout)
+            return -1
+        during = distance / 100.0 * 2 / self.SOUND_SPEED
+        if during > self.timeout:
+            clock.sleep(self.timeout)
+            return -1
+        clock.sleep(during)
+        return round(during * self.SOUND_SPEED / 2 * 100, 2)
+
+    def read(self, times=10):
+        self._backend.reads += 1
+        for _ in range(times):
+            value = self._read()
+            if value != -1:
+                return value
+        return -1
+
+
+class SimBackend(Backend):
+    '''
+    In-process stand-in for the Robot HAT.
+
+    Every device keeps its last written state in memory, config files
+    live in `config_data` keyed by path. Sensor inputs
+    are set with set_grayscale() and set_distance(). Bus operations are
+    counted in `writes` and `reads`, and can be given a latency that is
+    charged to the clock (a VirtualClock by default, so nothing blocks).
+    A batch passed to flush() counts as one bus transaction and pays the
+    write latency once.
+    '''
+
+    def __init__(self, clock=None, write_latency=0.0, adc_latency=0.0):
+        super().__init__(clock if clock is not None else VirtualClock())
+        self.write_latency = write_latency
+        self.adc_latency = adc_latency
+        self.writes = 0
+        self.transactions = 0
+        self.reads = 0
+        self.resets = 0
+        self.distance = None
+        self.devices = {}
+        self.config_data = {}
+        self.config_writes = 0
+        self._grayscale = None
+        self._grayscale_values = None
+        self._in_batch = False
+
+    def _write(self):
+        self.writes += 1
+        if self._in_batch:
+            return
+        self.transactions += 1
+        if self.write_latency:
+            self.clock.sleep(self.write_latency)
+
+    def flush(self, writes):
+        self.transactions += 1
+        if self.write_latency:
+            self.clock.sleep(self.write_latency)
+        self._in_batch = True
+        try:
+            for device, method, args in writes:
+                getattr(device, method)(*args)
+        finally:
+            self._in_batch = False
+
+    def _read(self, latency):
+        self.reads += 1
+        if latency:
+            self.clock.sleep(latency)
+
+    def _add(self, name, device):
+        self.devices[name] = device
+        return device
+
+    def reset_mcu(self):
+        self.resets += 1
+
+    def pin(self, name):
+        return self._add(name, SimPin(self, name))
+
+    def input_pin(self, name):
+        return self._add(name, SimPin(self, name))
+
+    def pwm(self, channel):
+        return self._add(channel, SimPWM(self, channel))
+
+    def adc(self, channel):
+        return self._add(channel, SimADC(self, channel))
+
+    def servo(self, channel):
+        return self._add(channel, SimServo(self, channel))
+
+    def grayscale_module(self, adc0, adc1, adc2, reference=None):
+        self._grayscale = SimGrayscaleModule(adc0, adc1, adc2, reference)
+        if self._grayscale_values is not None:
+            self.set_grayscale(self._grayscale_values)
+        return self._grayscale
+
+    def ultrasonic(self, trig, echo, timeout=0.02):
+        return SimUltrasonic(self, trig, echo, timeout)
+
+    def read_config(self, path):
+        return copy.deepcopy(self.config_data.get(path, {}))
+
+    def write_config(self, path, data):
+        self.config_writes += 1
+        self.config_data[path] = copy.deepcopy(data)
+
+    def set_grayscale(self, values):
+        '''
+        Set the values read by the grayscale module. They are kept until
+        the module is created, e.g. on a warm started Picarx.
+        '''
+        self._grayscale_values = list(values)
+        if self._grayscale is not None:
+            for adc, value in zip(self._grayscale.pins, values):
+                adc.value = value
+
+    def set_distance(self, distance):
+        '''
+        Set the range seen by the ultrasonic sensor in cm, None for no echo.
+        '''
+        self.distance = distance
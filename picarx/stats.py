@@ -0,0 +1,106 @@
+import time
+
+
+class LatencyHistogram(object):
+    ''' log-linear latency histogram in nanoseconds
+
+    Like an HDR histogram: values below 2*SUB_BUCKETS get a bucket each,
+    above that every power of two is split into SUB_BUCKETS equal
+    buckets, so percentiles are accurate to about 1/SUB_BUCKETS (6%) of
+    the value in constant memory and O(1) per record.
+    '''
+
+    SUB_BITS = 4
+    SUB_BUCKETS = 1 << SUB_BITS
+    BUCKETS = 1024  # reaches past 10**11 ns
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.reset()
+
+    def reset(self):
+        for i in range(self.BUCKETS):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @classmethod
+    def bucket(cls, value):
+        if value < 2 * cls.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - cls.SUB_BITS - 1
+        index = (shift + 1) * cls.SUB_BUCKETS + (value >> shift) - cls.SUB_BUCKETS
+        return min(index, cls.BUCKETS - 1)
+
+    @classmethod
+    def bucket_value(cls, index):
+        '''
+        Lowest value that falls in bucket index.
+        '''
+        if index < 2 * cls.SUB_BUCKETS:
+            return index
+        shift = index // cls.SUB_BUCKETS - 1
+        return (index % cls.SUB_BUCKETS + cls.SUB_BUCKETS) << shift
+
+    def record(self, value):
+        value = int(value)
+        if value < 0:
+            value = 0
+        self.counts[self.bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        '''
+        Value at percentile p (0-100), as the lower bound of its bucket.
+        '''
+        if not self.count:
+            return None
+        rank = max(1, int(round(p / 100.0 * self.count)))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return max(self.min, min(self.max, self.bucket_value(index)))
+        return self.max
+
+    def snapshot(self):
+        '''
+        Summary in microseconds.
+        '''
+        if not self.count:
+            return {'count': 0}
+        us = lambda ns: ns / 1000.0
+        return {
+            'count': self.count,
+            'mean_us': us(self.total / self.count),
+            'min_us': us(self.min),
+            'p50_us': us(self.percentile(50)),
+            'p90_us': us(self.percentile(90)),
+            'p99_us': us(self.percentile(99)),
+            'p999_us': us(self.percentile(99.9)),
+            'max_us': us(self.max),
+        }
+
+
+def timed(func, histogram):
+    '''
+    Wrap func so every call's duration is recorded in histogram.
+    '''
+    clock = time.perf_counter_ns
+    record = histogram.record
+
+    def wrapper(*args, **kwargs):
+        start = clock()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record(clock() - start)
+    wrapper.__wrapped__ = func
+    return wrapper
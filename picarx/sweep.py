@@ -0,0 +1,371 @@
+'''
+    Parameter sweeps of the control behaviours in simulation.
+
+    Every configuration is run for a number of episodes on a SimBackend
+    car moving through a small kinematic world, spread over a process
+    pool, and the episode metrics are aggregated per configuration:
+
+        python3 -m picarx.sweep line_follow --grid speed=10,20,30 kp=20,30,40
+        python3 -m picarx.sweep avoid_obstacles --grid safe_distance=30,40,50 \\
+            danger_distance=15,20 --episodes 8
+
+    line_follow runs a LineTracker around a circular line and reports
+    lap_time (None if no lap was completed) and line_losses.
+    avoid_obstacles runs an ObstacleAvoider in a walled arena with
+    randomly placed posts and reports min_distance (closest approach of
+    the car to a post or wall, in cm), collisions and travelled (cm).
+'''
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from . import telemetry
+from .avoidance import ObstacleAvoider
+from .line_tracking import LineTracker, PID
+from .picarx import Picarx
+from .sim import SimBackend
+
+# car geometry, in cm
+WHEELBASE = 9.5
+CAR_RADIUS = 10.0
+# cm/s per unit of motor speed
+SPEED_SCALE = 1.0
+
+
+class Odometer(object):
+    '''
+    Recorder stand-in that keeps the latest motor speeds, so the world
+    can move the car by what the controller commanded.
+    '''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.left = 0.0
+        self.right = 0.0
+
+    def record(self, kind, channel=0, v0=0.0, v1=0.0, v2=0.0):
+        if kind == telemetry.MOTOR:
+            if channel == 1:
+                self.left = v0
+            else:
+                self.right = v0
+
+    @property
+    def speed(self):
+        # the right motor is mounted mirrored, forward is negative
+        return (self.left - self.right) / 2.0
+
+    def close(self):
+        pass
+
+
+class World(object):
+    ''' kinematic bicycle model of the car on a SimBackend
+
+    step(dt) moves the car by the commanded speed and steering angle,
+    sets the virtual clock and updates the simulated sensors. Positive
+    steering angles turn right, as on the car.
+    '''
+
+    def __init__(self, px, backend):
+        self.px = px
+        self.backend = backend
+        self.odometer = Odometer()
+
+    def reset(self, x, y, heading):
+        # worlds share the car, the one being reset drives it
+        self.px.recorder = self.odometer
+        self.x, self.y, self.heading = x, y, heading
+        self.time = 0.0
+        self.travelled = 0.0
+        self.odometer.reset()
+        self.backend.clock.set(0.0)
+        self.sense()
+
+    def step(self, dt):
+        v = self.odometer.speed * SPEED_SCALE
+        steer = math.radians(self.px.dir_current_angle)
+        x = self.x + v * math.cos(self.heading) * dt
+        y = self.y + v * math.sin(self.heading) * dt
+        if self.allowed(x, y):
+            self.x, self.y = x, y
+            self.travelled += abs(v) * dt
+        self.heading -= v * math.tan(steer) / WHEELBASE * dt
+        self.time += dt
+        self.backend.clock.set(self.time)
+        self.sense()
+
+    def allowed(self, x, y):
+        return True
+
+    def sense(self):
+        pass
+
+
+class LineWorld(World):
+    ''' a dark circular line of RADIUS cm on a light floor '''
+
+    RADIUS = 60.0
+    LINE_WIDTH = 2.0
+    # grayscale sensors: ahead of the rear axle, spacing between them
+    SENSOR_AHEAD = 12.0
+    SENSOR_SPACING = 2.0
+    SENSOR_SPOT = 1.0
+    LINE_VALUE = 300
+    FLOOR_VALUE = 1500
+
+    def reset(self, x, y, heading):
+        self.progress = 0.0
+        self._angle = math.atan2(y, x)
+        World.reset(self, x, y, heading)
+
+    def step(self, dt):
+        World.step(self, dt)
+        angle = math.atan2(self.y, self.x)
+        delta = angle - self._angle
+        self.progress += (delta + math.pi) % (2 * math.pi) - math.pi
+        self._angle = angle
+
+    def sense(self):
+        cos, sin = math.cos(self.heading), math.sin(self.heading)
+        fx = self.x + self.SENSOR_AHEAD * cos
+        fy = self.y + self.SENSOR_AHEAD * sin
+        values = []
+        for lateral in (-self.SENSOR_SPACING, 0.0, self.SENSOR_SPACING):
+            # to the right of the heading is (sin, -cos)
+            sx, sy = fx + lateral * sin, fy - lateral * cos
+            off_line = abs(math.hypot(sx, sy) - self.RADIUS) - self.LINE_WIDTH / 2
+            cover = min(1.0, max(0.0, 0.5 - off_line / self.SENSOR_SPOT))
+            values.append(int(self.FLOOR_VALUE - (self.FLOOR_VALUE - self.LINE_VALUE) * cover))
+        self.backend.set_grayscale(values)
+
+
+class ArenaWorld(World):
+    ''' square arena of SIZE cm with round posts and an ultrasonic sensor '''
+
+    SIZE = 300.0
+    POST_RADIUS = 8.0
+    POSTS = 6
+    # half angle of the ultrasonic beam, in degrees, and rays cast per side
+    BEAM_ANGLE = 15.0
+    BEAM_RAYS = 3
+
+    def reset(self, x, y, heading, posts=()):
+        self.posts = list(posts)
+        self.collisions = 0
+        self._touching = False
+        World.reset(self, x, y, heading)
+        self.min_distance = self.clearance(self.x, self.y)
+
+    def clearance(self, x, y):
+        half = self.SIZE / 2
+        clearance = min(half - abs(x), half - abs(y))
+        for px, py in self.posts:
+            clearance = min(clearance, math.hypot(x - px, y - py) - self.POST_RADIUS)
+        return clearance - CAR_RADIUS
+
+    def allowed(self, x, y):
+        # the car stops against whatever it runs into
+        touching = self.clearance(x, y) <= 0
+        if touching and not self._touching:
+            self.collisions += 1
+        self._touching = touching
+        return not touching
+
+    def step(self, dt):
+        World.step(self, dt)
+        self.min_distance = min(self.min_distance, self.clearance(self.x, self.y))
+
+    def sense(self):
+        # the echo comes back from the nearest thing inside the beam
+        ox = self.x + CAR_RADIUS * math.cos(self.heading)
+        oy = self.y + CAR_RADIUS * math.sin(self.heading)
+        spread = math.radians(self.BEAM_ANGLE)
+        rays = [self.heading + spread * i / self.BEAM_RAYS for i in range(-self.BEAM_RAYS, self.BEAM_RAYS + 1)]
+        self.backend.set_distance(max(0.0, min(self.cast(ox, oy, ray) for ray in rays)))
+
+    def cast(self, ox, oy, angle):
+        cos, sin = math.cos(angle), math.sin(angle)
+        half = self.SIZE / 2
+        ranges = []
+        for position, direction in ((ox, cos), (oy, sin)):
+            if direction > 1e-9:
+                ranges.append((half - position) / direction)
+            elif direction < -1e-9:
+                ranges.append((-half - position) / direction)
+        for px, py in self.posts:
+            dx, dy = px - ox, py - oy
+            along = dx * cos + dy * sin
+            miss = dx * dx + dy * dy - along * along
+            if along > 0 and miss <= self.POST_RADIUS ** 2:
+                ranges.append(along - math.sqrt(self.POST_RADIUS ** 2 - miss))
+        return min(ranges)
+
+
+def line_follow(car, params, seed, duration=60.0):
+    ''' one lap attempt of a LineTracker
+
+    params: LineTracker arguments (speed, slowdown, recovery_speed, ...)
+            and the steering PID gains kp, ki and kd
+    '''
+    px, world = car['px'], car['line']
+    rng = random.Random(seed)
+    params = dict(params)
+    gains = [params.pop(gain, default) for gain, default in (('kp', 30.0), ('ki', 0.0), ('kd', 1.0))]
+    pid = PID(*gains, output_limits=(px.DIR_MIN, px.DIR_MAX), integral_limit=1.0)
+    tracker = LineTracker(px, steer_pid=pid, **params)
+    # start on the line heading counterclockwise, a little off its tangent
+    world.reset(LineWorld.RADIUS + rng.uniform(-1.0, 1.0), 0.0,
+                math.pi / 2 + math.radians(rng.uniform(-5, 5)))
+    dt = 1.0 / tracker.frequency
+    lap_time = None
+    while world.time < duration:
+        if tracker.step() == tracker.LOST:
+            break
+        world.step(dt)
+        if world.progress >= 2 * math.pi:
+            lap_time = world.time
+            break
+    px.stop()
+    return {'lap_time': lap_time, 'line_losses': tracker.line_losses}
+
+
+def avoid_obstacles(car, params, seed, duration=60.0):
+    ''' an ObstacleAvoider roaming the arena
+
+    params: ObstacleAvoider arguments (power, safe_distance,
+            danger_distance, turn_angle, ...)
+    '''
+    px, world = car['px'], car['arena']
+    rng = random.Random(seed)
+    half = ArenaWorld.SIZE / 2 - 30
+    posts = []
+    while len(posts) < ArenaWorld.POSTS:
+        post = (rng.uniform(-half, half), rng.uniform(-half, half))
+        if math.hypot(*post) > 40:
+            posts.append(post)
+    avoider = ObstacleAvoider(px, **params)
+    world.reset(0.0, 0.0, rng.uniform(-math.pi, math.pi), posts)
+    dt = 1.0 / avoider.loop.frequency
+    while world.time < duration:
+        avoider.tick()
+        world.step(dt)
+    px.stop()
+    return {'min_distance': world.min_distance, 'collisions': world.collisions,
+            'travelled': world.travelled}
+
+
+SCENARIOS = {
+    'line_follow': line_follow,
+    'avoid_obstacles': avoid_obstacles,
+}
+
+# warm car of this worker process, built once by _init_worker
+_car = None
+
+
+def _init_worker():
+    global _car
+    backend = SimBackend()
+    px = Picarx(backend=backend)
+    px.set_line_reference([900, 900, 900])
+    _car = {'px': px, 'backend': backend,
+            'line': LineWorld(px, backend), 'arena': ArenaWorld(px, backend)}
+
+
+def _run_episode(task):
+    index, scenario, params, seed, duration = task
+    if _car is None:
+        _init_worker()
+    return index, SCENARIOS[scenario](_car, params, seed, duration)
+
+
+def param_grid(**axes):
+    ''' every combination of the given parameter values
+
+    param_grid(speed=[10, 20], kp=[20, 30]) gives four dicts
+    '''
+    names = sorted(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*(axes[name] for name in names))]
+
+
+def _aggregate(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return {'mean': None, 'min': None, 'max': None, 'count': 0}
+    return {'mean': sum(values) / len(values), 'min': min(values),
+            'max': max(values), 'count': len(values)}
+
+
+def sweep(scenario, configs, episodes=4, duration=60.0, processes=None, seed=0):
+    ''' run every configuration for a number of episodes in parallel
+
+    Episode i of every configuration uses the same seed, so
+    configurations are compared on the same start poses and arenas.
+    Each worker process builds one SimBackend car up front and reuses it
+    for all of its episodes.
+
+    param scenario: name in SCENARIOS
+    param configs: list of parameter dicts, e.g. from param_grid()
+    param processes: worker processes, None for one per CPU and 0 to
+                     run in this process
+    return: one dict per configuration, in order, with its params and
+            {'mean', 'min', 'max', 'count'} of every episode metric
+    '''
+    if scenario not in SCENARIOS:
+        raise ValueError("unknown scenario %r, expected one of %s" % (scenario, sorted(SCENARIOS)))
+    tasks = [(index, scenario, params, seed + episode, duration)
+             for index, params in enumerate(configs) for episode in range(episodes)]
+    outcomes = [[] for _ in configs]
+    if processes == 0:
+        for task in tasks:
+            index, metrics = _run_episode(task)
+            outcomes[index].append(metrics)
+    else:
+        workers = processes or os.cpu_count() or 1
+        chunksize = max(1, len(tasks) // (workers * 4))
+        with ProcessPoolExecutor(workers, initializer=_init_worker) as pool:
+            for index, metrics in pool.map(_run_episode, tasks, chunksize=chunksize):
+                outcomes[index].append(metrics)
+
+    results = []
+    for params, metrics in zip(configs, outcomes):
+        result = {'params': params, 'episodes': len(metrics)}
+        for name in metrics[0] if metrics else ():
+            result[name] = _aggregate([m[name] for m in metrics])
+        results.append(result)
+    return results
+
+
+def _parse_axis(text):
+    name, _, values = text.partition('=')
+    if not values:
+        raise argparse.ArgumentTypeError("expected name=value,value,... got %r" % text)
+    return name, [json.loads(value) for value in values.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenario', choices=sorted(SCENARIOS))
+    parser.add_argument('--grid', nargs='*', type=_parse_axis, default=[],
+                        help='parameter values to sweep, name=v1,v2,...')
+    parser.add_argument('--episodes', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=60.0, help='simulated seconds per episode')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    results = sweep(args.scenario, param_grid(**dict(args.grid)), args.episodes,
+                    args.duration, args.processes, args.seed)
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import struct
+import threading
+
+import numpy as np
+
+
+MAGIC = b'PICARXT1'
+
+# record kinds
+MOTOR = 1       # channel: motor index, values: speed
+SERVO = 2       # channel: DIR_SERVO/CAM_PAN/CAM_TILT, values: angle
+GRAYSCALE = 3   # values: left, middle, right
+DISTANCE = 4    # values: distance in cm
+
+DIR_SERVO = 0
+CAM_PAN = 1
+CAM_TILT = 2
+
+# timestamp, kind, channel, 2 pad bytes, three values: 24 bytes per record
+RECORD = struct.Struct('<dBB2xfff')
+RECORD_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('kind', 'u1'),
+    ('channel', 'u1'),
+    ('pad', 'V2'),
+    ('values', '<f4', (3,)),
+])
+
+
+class Recorder(object):
+    ''' fixed-width binary telemetry recorder
+
+    record() packs one 24 byte record into a preallocated buffer; a
+    background thread writes full buffers (and, every flush_interval
+    seconds, partial ones) to the sink, so the caller never does file
+    I/O. There are two buffers of `capacity` records; if the writer falls
+    behind and both are full, new records are dropped and counted in
+    `dropped` rather than blocking the control loop.
+
+    The output is MAGIC followed by the records, see read_telemetry().
+    '''
+
+    def __init__(self, sink, clock, capacity=4096, flush_interval=0.5):
+        if isinstance(sink, str):
+            self._file = open(sink, 'wb')
+            self._own_file = True
+        else:
+            self._file = sink
+            self._own_file = False
+        self.clock = clock
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self._buffer = bytearray(capacity * RECORD.size)
+        self._spare = bytearray(capacity * RECORD.size)
+        self._count = 0
+        self._full = None
+        self.recorded = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._running = True
+        self._file.write(MAGIC)
+        self._thread = threading.Thread(target=self._loop, name='picarx-telemetry')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def record(self, kind, channel=0, v0=0.0, v1=0.0, v2=0.0):
+        timestamp = self.clock.time()
+        with self._lock:
+            if self._count == self.capacity:
+                if self._spare is None:
+                    self.dropped += 1
+                    return
+                self._swap()
+            RECORD.pack_into(self._buffer, self._count * RECORD.size, timestamp, kind, channel, v0, v1, v2)
+            self._count += 1
+            self.recorded += 1
+
+    def _swap(self):
+        # hand the active buffer to the writer; caller holds the lock
+        self._full = (self._buffer, self._count)
+        self._buffer = self._spare
+        self._spare = None
+        self._count = 0
+        self._wake.notify()
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                if self._full is None and self._running:
+                    self._wake.wait(self.flush_interval)
+                if self._full is None and self._count and self._spare is not None:
+                    self._swap()
+                full, self._full = self._full, None
+                running = self._running
+            if full is not None:
+                buffer, count = full
+                self._file.write(memoryview(buffer)[:count * RECORD.size])
+                self._file.flush()
+                with self._lock:
+                    self._spare = buffer
+            elif not running:
+                return
+
+    def close(self):
+        '''
+        Write out everything recorded so far and stop the writer thread.
+        '''
+        with self._lock:
+            self._running = False
+            self._wake.notify()
+        self._thread.join()
+        if self._own_file:
+            self._file.close()
+
+
+def read_telemetry(source):
+    ''' load a recording as a NumPy structured array
+
+    Fields are timestamp, kind, channel and values (three float32).
+
+    param source: path, or bytes of a recording
+    '''
+    if isinstance(source, (bytes, bytearray)):
+        data = bytes(source)
+    else:
+        with open(source, 'rb') as f:
+            data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError("not a picarx telemetry recording")
+    body = data[len(MAGIC):]
+    usable = len(body) - len(body) % RECORD.size
+    return np.frombuffer(body[:usable], dtype=RECORD_DTYPE)
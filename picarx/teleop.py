@@ -0,0 +1,191 @@
+import json
+import math
+import random
+import socket
+import threading
+import time
+
+from .stats import LatencyHistogram
+
+
+class TeleopServer(object):
+    ''' UDP teleoperation server for Picarx
+
+    Clients send JSON datagrams such as
+        {"session": 7, "seq": 12, "speed": 40, "steer": -10, "pan": 0, "tilt": 15}
+    where every field but seq is optional and the others must be numbers;
+    anything else is counted in `invalid` and ignored. A receiver thread
+    keeps only the newest command (highest seq; older or repeated seqs
+    are stale and dropped), and an actuation loop applies it at `rate`
+    Hz, so a burst of commands costs one actuation. If no command arrives
+    for deadman_timeout seconds the car is stopped.
+
+    seq counts within a session: a command with a new session id, or
+    any command after more than deadman_timeout of silence, starts
+    over, so a restarted client can drive again.
+
+    If applying a command raises, the car is stopped, the exception is
+    kept in `error` and counted in `errors`; the loop keeps running.
+
+    latency holds the time, in ns, from a command arriving to it being
+    applied. Bind to port 0 to get a free port, see `address`.
+    '''
+
+    FIELDS = ('speed', 'steer', 'pan', 'tilt')
+
+    def __init__(self, px, host='0.0.0.0', port=8765, rate=50, deadman_timeout=0.5):
+        self.px = px
+        self.rate = rate
+        self.deadman_timeout = deadman_timeout
+        self.latency = LatencyHistogram()
+        self.received = 0
+        self.applied = 0
+        self.coalesced = 0
+        self.stale = 0
+        self.invalid = 0
+        self.deadman_stops = 0
+        self.errors = 0
+        self.error = None
+        self._latest = None      # (seq, command, arrival ns, session)
+        self._applied_seq = None
+        self._last_arrival = None
+        self._stopped = True
+        self._running = threading.Event()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((host, port))
+        self._sock.settimeout(0.1)
+        self._loop = px.control_loop(self._actuate, rate)
+        self._receiver = None
+
+    @property
+    def address(self):
+        return self._sock.getsockname()
+
+    def start(self):
+        self._running.set()
+        self._receiver = threading.Thread(target=self._receive, name='picarx-teleop-rx')
+        self._receiver.daemon = True
+        self._receiver.start()
+        self._loop.start()
+
+    def stop(self):
+        self._running.clear()
+        self._loop.stop()
+        if self._receiver is not None:
+            self._receiver.join()
+            self._receiver = None
+        self._sock.close()
+        self.px.stop()
+
+    def stats(self):
+        return {
+            'received': self.received,
+            'applied': self.applied,
+            'coalesced': self.coalesced,
+            'stale': self.stale,
+            'invalid': self.invalid,
+            'deadman_stops': self.deadman_stops,
+            'errors': self.errors,
+            'latency': self.latency.snapshot(),
+        }
+
+    def _receive(self):
+        while self._running.is_set():
+            try:
+                data, _ = self._sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            arrival = time.perf_counter_ns()
+            try:
+                seq, session, command = self._parse(data)
+            except (ValueError, KeyError, TypeError):
+                self.invalid += 1
+                continue
+            self.received += 1
+            latest = self._latest
+            if latest is not None and seq <= latest[0] and session == latest[3] and \
+                    arrival - latest[2] <= self.deadman_timeout * 1e9:
+                self.stale += 1
+                continue
+            if latest is not None and latest[:1] + latest[3:] != self._applied_seq:
+                # the previous command was never applied: latest wins
+                self.coalesced += 1
+            self._latest = (seq, command, arrival, session)
+
+    def _parse(self, data):
+        message = json.loads(data)
+        if not isinstance(message, dict):
+            raise TypeError('command must be a JSON object')
+        seq = message['seq']
+        session = message.get('session')
+        if type(seq) is not int or (session is not None and type(session) is not int):
+            raise TypeError('seq and session must be integers')
+        command = {}
+        for field in self.FIELDS:
+            if field in message:
+                value = message[field]
+                if isinstance(value, bool):
+                    raise TypeError('%s must be a number' % field)
+                value = float(value)
+                if not math.isfinite(value):
+                    raise ValueError('%s must be finite' % field)
+                # whole numbers stay int for the drive lookup tables
+                command[field] = int(value) if value.is_integer() else value
+        return seq, session, command
+
+    def _actuate(self):
+        # an exception here would end the loop and with it the deadman
+        try:
+            self._apply()
+        except Exception as e:
+            self.errors += 1
+            self.error = e
+            self._stopped = True
+            self.px.stop_motors()
+
+    def _apply(self):
+        px = self.px
+        latest = self._latest
+        if latest is not None and latest[:1] + latest[3:] != self._applied_seq:
+            seq, command, arrival, session = latest
+            # mark it applied first, a failing command is not retried
+            self._applied_seq = (seq, session)
+            self._last_arrival = arrival
+            self._stopped = False
+            if 'speed' in command or 'steer' in command:
+                px.drive(command.get('speed', 0), command.get('steer', px.dir_current_angle))
+            if 'pan' in command:
+                px.set_cam_pan_angle(command['pan'])
+            if 'tilt' in command:
+                px.set_cam_tilt_angle(command['tilt'])
+            self.latency.record(time.perf_counter_ns() - arrival)
+            self.applied += 1
+        elif not self._stopped and self._last_arrival is not None and \
+                time.perf_counter_ns() - self._last_arrival > self.deadman_timeout * 1e9:
+            px.stop()
+            self._stopped = True
+            self.deadman_stops += 1
+
+
+class TeleopClient(object):
+    '''
+    Sends numbered commands to a TeleopServer, under a random session id
+    so the server does not take a restarted client's seqs as stale.
+    '''
+
+    def __init__(self, host, port=8765):
+        self.address = (host, port)
+        self.seq = 0
+        self.session = random.getrandbits(31)
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, **command):
+        self.seq += 1
+        command['seq'] = self.seq
+        command['session'] = self.session
+        self._sock.sendto(json.dumps(command).encode(), self.address)
+
+    def close(self):
+        self._sock.close()
@@ -0,0 +1,131 @@
+import os
+import queue
+import threading
+import time
+import warnings
+
+from .loop import ControlLoop
+from .stats import LatencyHistogram
+
+
+class CliffWatchdog(object):
+    ''' background cliff guard that stops the motors on its own
+
+    Reads the grayscale channels at `rate` Hz in a ControlLoop and
+    compares them with px.cliff_reference. When a cliff appears it cuts
+    both motor PWMs straight away, from its own thread, then hands the
+    event to on_cliff(values) on a separate notifier thread, so a slow
+    callback (text to speech, logging) can never delay the next sample.
+    It fires once per cliff and re-arms when the cliff clears, leaving
+    the app free to back away.
+
+    The thread asks for SCHED_FIFO real-time priority, which needs root;
+    without it it runs at normal priority. `latency` holds the time from
+    detection to the stop write completing, in ns.
+
+    A failed read (a transient I2C error, say) stops the motors as a
+    cliff would, since the watchdog can't see the floor. It and any
+    exception raised by on_cliff are kept in `error`, counted in `errors`
+    and reported with a RuntimeWarning; the watchdog carries on.
+    '''
+
+    def __init__(self, px, rate=200, on_cliff=None, realtime_priority=10):
+        self.px = px
+        self.rate = rate
+        self.on_cliff = on_cliff
+        self.realtime_priority = realtime_priority
+        self.clock = px.backend.clock
+        self.latency = LatencyHistogram()
+        self.triggered = 0
+        self.cliff = False
+        self.cliff_event = threading.Event()
+        self.realtime = False
+        self.errors = 0
+        self.error = None
+        self._last_latency = None
+        self._loop = ControlLoop(self._step, rate, clock=self.clock)
+        self._prioritized = False
+        self._notify_queue = queue.Queue()
+        self._notifier = None
+
+    @property
+    def running(self):
+        return self._loop.running
+
+    def start(self):
+        if self.running:
+            return
+        self._prioritized = False
+        self._loop.start()
+        self._notifier = threading.Thread(target=self._notify_loop, name='picarx-cliff-notify')
+        self._notifier.daemon = True
+        self._notifier.start()
+
+    def stop(self):
+        self._loop.stop()
+        if self._notifier is not None:
+            self._notify_queue.put(None)
+            self._notifier.join()
+            self._notifier = None
+
+    def last_latency_us(self):
+        return None if self._last_latency is None else self._last_latency / 1000.0
+
+    def _set_priority(self):
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.realtime_priority))
+            self.realtime = True
+        except (AttributeError, OSError):
+            self.realtime = False
+
+    def check(self, values):
+        '''
+        Handle one grayscale sample; returns True while there is a cliff.
+        '''
+        cliff = False
+        for value, reference in zip(values, self.px.cliff_reference):
+            if value <= reference:
+                cliff = True
+                break
+        if cliff and not self.cliff:
+            detected = time.perf_counter_ns()
+            self.px.stop_motors()
+            self._last_latency = time.perf_counter_ns() - detected
+            self.latency.record(self._last_latency)
+            self.triggered += 1
+            self.cliff_event.set()
+            self._notify_queue.put(list(values))
+        elif not cliff and self.cliff:
+            self.cliff_event.clear()
+        self.cliff = cliff
+        return cliff
+
+    def _step(self):
+        if not self._prioritized:
+            # the first step runs on the loop's own thread
+            self._prioritized = True
+            self._set_priority()
+        try:
+            values = self.px.grayscale.read()
+        except Exception as e:
+            # blind for this sample: fail safe
+            self.px.stop_motors()
+            self._report(e, "cliff watchdog read failed")
+            return
+        self.check(values)
+
+    def _report(self, error, what):
+        self.errors += 1
+        self.error = error
+        warnings.warn("%s: %r" % (what, error), RuntimeWarning)
+
+    def _notify_loop(self):
+        while True:
+            values = self._notify_queue.get()
+            if values is None:
+                return
+            if self.on_cliff is not None:
+                try:
+                    self.on_cliff(values)
+                except Exception as e:
+                    self._report(e, "cliff callback raised")
@@ -22,6 +22,7 @@ setuptools.setup(
     ],
     install_requires=[
         "spidev >= 3.2",
-        "readchar"
+        "readchar",
+        "numpy"
     ]
 )
\ No newline at end of file
@@ -0,0 +1,113 @@
+import json
+import socket
+import time
+
+import pytest
+
+from picarx import MonotonicClock, Picarx, SimBackend, TeleopClient, TeleopServer
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+@pytest.fixture
+def car():
+    backend = SimBackend(clock=MonotonicClock())
+    return Picarx(backend=backend), backend
+
+
+@pytest.fixture
+def server(car):
+    px, _ = car
+    server = TeleopServer(px, host='127.0.0.1', port=0, rate=20, deadman_timeout=0.2)
+    server.start()
+    yield server
+    server.stop()
+
+
+def motor_power(px):
+    return [pin.pulse_width_percent() for pin in px.motor_speed_pins]
+
+
+def test_burst_is_coalesced_into_the_newest_command(car, server):
+    px, _ = car
+    client = TeleopClient(*server.address)
+    for steer in range(-20, 21):
+        client.send(speed=40, steer=steer)
+    assert wait_for(lambda: server.received == 41 and server.applied >= 1 and
+                    px.dir_current_angle == 20)
+    assert server.applied < server.received
+    assert server.coalesced > 0
+    client.close()
+
+
+def test_deadman_stops_the_car(car, server):
+    px, _ = car
+    client = TeleopClient(*server.address)
+    client.send(speed=40, steer=0)
+    assert wait_for(lambda: server.applied == 1)
+    assert max(motor_power(px)) > 0
+    assert wait_for(lambda: server.deadman_stops == 1)
+    assert motor_power(px) == [0, 0]
+    client.close()
+
+
+def test_restarted_client_can_drive_again(car, server):
+    px, _ = car
+    first = TeleopClient(*server.address)
+    for _ in range(5):
+        first.send(speed=10, steer=0)
+    assert wait_for(lambda: server.received == 5)
+    first.close()
+
+    second = TeleopClient(*server.address)
+    second.send(speed=30, steer=-15)
+    assert wait_for(lambda: px.dir_current_angle == -15)
+    assert server.stale == 0
+    second.close()
+
+
+def test_malformed_commands_are_counted_and_ignored(car, server):
+    px, _ = car
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for datagram in [b'not json', b'[1, 2]', b'{"speed": 40}',
+                     json.dumps({'seq': 1, 'speed': 'fast'}).encode(),
+                     json.dumps({'seq': 2, 'steer': [1]}).encode(),
+                     json.dumps({'seq': 3, 'pan': True}).encode(),
+                     b'{"seq": 4, "tilt": NaN}']:
+        sock.sendto(datagram, server.address)
+    assert wait_for(lambda: server.invalid == 7)
+    assert server.received == 0
+
+    # the loop is still alive: a good command applies and the deadman fires
+    sock.sendto(json.dumps({'seq': 5, 'speed': 60, 'steer': 10}).encode(), server.address)
+    assert wait_for(lambda: px.dir_current_angle == 10)
+    assert wait_for(lambda: server.deadman_stops == 1)
+    assert motor_power(px) == [0, 0]
+    sock.close()
+
+
+def test_failing_command_stops_the_car_and_keeps_the_loop(car, server):
+    px, _ = car
+    client = TeleopClient(*server.address)
+    client.send(speed=60, steer=0)
+    assert wait_for(lambda: server.applied == 1)
+
+    def broken(value):
+        raise RuntimeError('servo fault')
+    px.set_cam_pan_angle = broken
+    client.send(speed=60, steer=0, pan=10)
+    assert wait_for(lambda: server.errors == 1)
+    assert isinstance(server.error, RuntimeError)
+    assert motor_power(px) == [0, 0]
+
+    del px.set_cam_pan_angle
+    client.send(speed=30, steer=5)
+    assert wait_for(lambda: px.dir_current_angle == 5)
+    client.close()